@@ -1,6 +1,6 @@
 #!/usr/local/bin/python3.8
 
-from uar.cluster import methods
+from uar.cluster import energy, methods
 from uar.landform import generator
 
 import matplotlib
@@ -12,9 +12,20 @@ class PlotDisplay(object):
                  kmeans=True,
                  leach=True,
                  land_width=200,
-                 round_count=1500):
+                 round_count=1500,
+                 vectorized=False,
+                 seed=None,
+                 cache=None):
+        """
+        :param vectorized: run LEACH on energy.LeachEngine, for large lands
+        :param seed: seed of the landform and of LeachEngine, see generator.LandForm
+        :param cache: passed to methods.KMeansCluster
+        """
         self.round_count = round_count
-        self.land = generator.LandForm(land_width, land_width)
+        self.vectorized = vectorized
+        self.seed = seed
+        self.cache = cache
+        self.land = generator.LandForm(land_width, land_width, seed=seed)
         self.consumptions = {}
         self.remains = {}
         self.dead_nodes = {}
@@ -39,7 +50,7 @@ class PlotDisplay(object):
         self.show()
 
     def use_kmeans(self):
-        kc = methods.KMeansCluster(self.land, 0.4)
+        kc = methods.KMeansCluster(self.land, 0.4, self.cache)
         kcc = []
         kcr = []
         kcdn = []
@@ -51,7 +62,7 @@ class PlotDisplay(object):
         return kcc, kcr, kcdn
 
     def use_kmeans_rehead(self):
-        kc = methods.KMeansCluster(self.land)
+        kc = methods.KMeansCluster(self.land, cache=self.cache)
         kcc = []
         kcr = []
         kcdn = []
@@ -63,7 +74,10 @@ class PlotDisplay(object):
         return kcc, kcr, kcdn
 
     def use_leach(self):
-        lc = methods.LeachCluster(self.land)
+        if self.vectorized:
+            lc = energy.LeachEngine(self.land.cities, seed=self.seed)
+        else:
+            lc = methods.LeachCluster(self.land)
         lcc = []
         lcr = []
         lcdn = []
@@ -0,0 +1,230 @@
+#!/usr/local/bin/python3.8
+import numpy as np
+
+from uar.cluster import methods
+from uar.cluster.methods import (MAX_BROADCAST_DISTANCE, NODE_INIT_ENERGY,
+                                 NODE_DEAD_ENERGY_THRESHOLD, Cluster,
+                                 leach_threshould)
+from uar.landform.spatial import GridIndex
+
+
+class EnergyEngine(object):
+    """
+    Energy model of Cluster.collect_once for many clusters at once, with the
+    nodes in arrays. The costs a member pays to reach its head are computed
+    when the head changes, so a round is a few vectorized deductions. The
+    formal_* methods of Cluster give every cost; the send costs come from
+    its array variant, so energies can differ from Cluster in the last bits.
+    """
+    def __init__(self,
+                 nodes_coord,
+                 labels,
+                 heads,
+                 energy=None,
+                 centers=None):
+        """
+        :param nodes_coord: (n, 2) coordinates, e.g. land.cities
+        :param labels: cluster of each node, -1 for none
+        :param heads: head node of each cluster
+        :param energy: initial energy of each node, NODE_INIT_ENERGY when None
+        :param centers: cluster centres, needed by rehead_nearest
+        """
+        self.nodes_coord = np.asarray(nodes_coord, dtype=float).reshape(-1, 2)
+        n = len(self.nodes_coord)
+        self.energy = np.full(n, float(NODE_INIT_ENERGY)) if energy is None \
+            else np.array(energy, dtype=float)
+        self.centers = None if centers is None else np.asarray(centers,
+                                                               dtype=float)
+        # per node, recomputed when heads change
+        self.send = np.zeros(n)  # send cost, 0 beyond MAX_BROADCAST_DISTANCE
+        self.receive = np.zeros(n)  # broadcast receive cost, 0 beyond it too
+        self.reach = np.zeros(n)  # distance the head broadcasts to for the node
+        self.is_head = np.zeros(n, dtype=bool)
+        # the costs that do not depend on distances
+        self.probe = probe = Cluster(None)
+        self.head_fixed = [
+            probe.formal_head_to_auv_consumption(),
+            probe.formal_fusion_consumption()
+        ]
+        self.receive_broadcast = \
+            probe.formal_node_receive_broadcast_consumption()
+        self.assign(labels, heads)
+
+    def assign(self, labels, heads):
+        """
+        Replace every cluster at once, e.g. for a new LEACH round.
+        """
+        self.labels = np.asarray(labels, dtype=int)
+        self.heads = np.array(heads, dtype=int)
+        order = np.argsort(self.labels, kind='stable')
+        bounds = np.searchsorted(self.labels[order],
+                                 np.arange(len(self.heads) + 1))
+        self.members = np.split(order[bounds[0]:bounds[-1]],
+                                bounds[1:-1] - bounds[0])
+        self.is_head[:] = False
+        self.is_head[self.heads] = True
+        labelled = order[bounds[0]:]
+        self._costs(labelled, self.heads[self.labels[labelled]])
+
+    def set_head(self, cluster: int, node: int):
+        self.is_head[self.heads[cluster]] = False
+        self.heads[cluster] = node
+        self.is_head[node] = True
+        self._costs(self.members[cluster], node)
+
+    def _costs(self, nodes: np.ndarray, heads):
+        d = np.sqrt(((self.nodes_coord[nodes] -
+                      self.nodes_coord[heads])**2).sum(axis=1)) * 0.1
+        near = d <= MAX_BROADCAST_DISTANCE
+        self.send[nodes] = np.where(
+            near, self.probe.formal_node_send_consumptions(d), 0)
+        self.receive[nodes] = np.where(near, self.receive_broadcast, 0)
+        self.reach[nodes] = np.minimum(d, MAX_BROADCAST_DISTANCE)
+
+    def alive(self):
+        return self.energy > NODE_DEAD_ENERGY_THRESHOLD
+
+    def collect_once(self):
+        """
+        One round of Cluster.collect_once for every cluster.
+        :return: consumption of each cluster
+        """
+        k = len(self.heads)
+        labelled = self.labels >= 0
+        members = np.flatnonzero(labelled & ~self.is_head & self.alive())
+        clusters = self.labels[members]
+        reach = np.zeros(k)
+        np.maximum.at(reach, clusters, self.reach[members])
+
+        # members pay the send, then the receive cost, in node order
+        self.energy[members] -= self.send[members]
+        self.energy[members] -= self.receive[members]
+        paid = np.stack([self.send[members], self.receive[members]],
+                        axis=1).ravel()
+        consumption = np.bincount(np.repeat(clusters, 2), paid,
+                                  minlength=k).astype(float)
+
+        heads = np.flatnonzero(self.alive()[self.heads])
+        head_nodes = self.heads[heads]
+        for cost in self.head_fixed:
+            self.energy[head_nodes] -= cost
+            consumption[heads] += cost
+        # alive count as seen by formal_head_receive_consumption at this point
+        alive = self.alive() & labelled
+        count = np.bincount(self.labels[alive], minlength=k)[heads]
+        receive = np.where(count > 1, (count - 1) * methods.Ti * methods.Pr,
+                           0)
+        self.energy[head_nodes] -= receive
+        consumption[heads] += receive
+        broadcast = np.array([
+            self.probe.formal_head_broadcast_consumption(v)
+            for v in reach[heads].tolist()
+        ])
+        self.energy[head_nodes] -= broadcast
+        consumption[heads] += broadcast
+        return consumption
+
+    def remain_energy(self):
+        """
+        :return: residual energy of each cluster
+        """
+        positive = (self.energy > 0) & (self.labels >= 0)
+        return np.bincount(self.labels[positive],
+                           self.energy[positive],
+                           minlength=len(self.heads))
+
+    def count_dead_node(self):
+        """
+        :return: dead nodes of each cluster
+        """
+        dead = ~self.alive() & (self.labels >= 0)
+        return np.bincount(self.labels[dead], minlength=len(self.heads))
+
+    def rehead_nearest(self):
+        """
+        Move the head of every cluster whose head died to the alive member
+        nearest to the centre, as KMeansCluster.find_head_center_nearest.
+        """
+        alive = self.alive()
+        for c in np.flatnonzero(~alive[self.heads]):
+            members = self.members[c][alive[self.members[c]]]
+            if not len(members):
+                continue
+            d = np.sqrt(((self.nodes_coord[members] -
+                          self.centers[c])**2).sum(axis=1))
+            self.set_head(c, members[np.argmin(d)])
+
+    def kmeans_collect_once(self):
+        """
+        Totals of KMeansCluster.collect_once.
+        :return: (consumption, remain, dead_node_count)
+        """
+        consumption = self.collect_once()
+        result = (sum(consumption.tolist()),
+                  sum(self.remain_energy().tolist()),
+                  int(self.count_dead_node().sum()))
+        self.rehead_nearest()
+        return result
+
+
+class LeachEngine(object):
+    """
+    LeachCluster on arrays: heads are drawn in one vectorized pass, every
+    other node joins its nearest head through a GridIndex, and the round is
+    collected by an EnergyEngine updated in place.
+    """
+    def __init__(self, nodes_coord, p=0.1, seed=None):
+        """
+        :param seed: seed of the random generator, same meaning as numpy.random.default_rng
+        """
+        self.p = p
+        self.rng = np.random.default_rng(seed)
+        self.index = GridIndex(nodes_coord)
+        n = len(self.index)
+        self.engine = EnergyEngine(self.index.points, np.full(n, -1), [])
+        self.excluded = np.zeros(n, dtype=bool)
+        self.all_dead = False
+
+    def cluster(self, r):
+        """
+        Elect this round's heads and assign the other nodes to them.
+        :return: False when no node can be elected
+        """
+        alive = self.engine.alive()
+        if r % int(1 / self.p) == 0 or \
+                alive.sum() <= self.excluded.sum():
+            self.excluded[:] = False
+        candidates = np.flatnonzero(alive & ~self.excluded)
+        if not len(candidates):
+            return False
+        t = leach_threshould(r, self.p)
+        heads = candidates[:0]
+        while not len(heads):  # as LeachCluster, sweep until someone is elected
+            heads = candidates[self.rng.random(len(candidates)) <= t]
+        self.excluded[heads] = True
+
+        is_head = np.zeros(len(self.index), dtype=bool)
+        is_head[heads] = True
+        others = np.flatnonzero(~is_head)
+        nearest, _ = self.index.nearest_each(self.index.points[others],
+                                             is_head)
+        labels = np.empty(len(self.index), dtype=int)
+        labels[heads] = np.arange(len(heads))
+        labels[others] = np.searchsorted(heads, nearest)
+        self.engine.assign(labels, heads)
+        return True
+
+    def collect_once(self, r):
+        """
+        :return: (consumption, remain, dead_node_count) of the round, as
+                 LeachCluster.collect_once
+        """
+        n = len(self.index)
+        if self.all_dead or not self.cluster(r):
+            self.all_dead = True
+            return 0, 0, n
+        consumption = self.engine.collect_once()
+        dead_node_count = int(n - self.engine.alive().sum())
+        self.all_dead = dead_node_count == n
+        return (sum(consumption.tolist()),
+                sum(self.engine.remain_energy().tolist()), dead_node_count)
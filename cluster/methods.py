@@ -2,11 +2,16 @@
 
 import random
 import math
+import multiprocessing as mp
 
+import numpy as np
+
+from uar.db.cache import cache_key, cached
 from uar.landform import generator
+from uar.landform.spatial import GridIndex
 
 import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 
 NODE_INIT_ENERGY = 2000
 NODE_DEAD_ENERGY_THRESHOLD = 0
@@ -24,6 +29,32 @@ def sigmoid_threshould(dr, er):
     return 1 / (1 + math.exp(-(0.01 * dr + 7 * er - 2.6)))
 
 
+def sigmoid_threshoulds(dr, er):
+    """
+    sigmoid_threshould over arrays.
+    """
+    return 1 / (1 + np.exp(-(0.01 * np.asarray(dr) + 7 * np.asarray(er) - 2.6)))
+
+
+def weighted_election(t):
+    """
+    Draw the node that a repeated sweep would pick, node i taken with
+    probability t[i] when reached. Node i wins a sweep with probability
+    t[i] * prod(1 - t[j] for j < i), and failed sweeps start over, so one
+    draw with these weights is equivalent.
+    :return: index into t, -1 when no node can be picked
+    """
+    t = np.asarray(t, dtype=float)
+    if not len(t):
+        return -1
+    w = t * np.concatenate([[1], np.cumprod(1 - t[:-1])])
+    cumulative = np.cumsum(w)
+    if cumulative[-1] <= 0:
+        return -1
+    k = np.searchsorted(cumulative, random.random() * cumulative[-1], 'right')
+    return int(min(k, len(t) - 1))
+
+
 def absorption_coefficient(f=10):
     return 0.11 * f * f / (1 + f * f) + 44 * f * f / (
         4100 + f * f) + 0.000275 * f * f + 0.003
@@ -39,6 +70,8 @@ Tf = 400
 a = math.pow(10, 0.1 * absorption_coefficient())
 
 MAX_BROADCAST_DISTANCE = 100 * 0.1
+MINIBATCH_NODES = 10000  # the elbow search fits MiniBatchKMeans from this many nodes
+GALLOP_BATCH = 4  # values of k the gallop search probes per round
 
 
 class Cluster(object):
@@ -48,11 +81,41 @@ class Cluster(object):
         self.head = head
         self.center_coord = center_coord
         self.exclude_head_candidates = set()
+        # kept up to date by add_node and deduct
+        self.dead_nodes = set()
+        self.alive_count = 0
+        self.residual_energy = 0
+        self.death_listeners = []
 
     def add_node(self, node, energy=None):
         if energy == None:
             energy = NODE_INIT_ENERGY
         self.nodes_energy[node] = energy
+        if energy <= NODE_DEAD_ENERGY_THRESHOLD:
+            self.dead_nodes.add(node)
+        else:
+            self.alive_count += 1
+        if energy > 0:
+            self.residual_energy += energy
+
+    def on_death(self, listener):
+        """
+        :param listener: called as listener(cluster, node) when deduct kills a node
+        """
+        self.death_listeners.append(listener)
+
+    def deduct(self, node, energy):
+        old = self.nodes_energy[node]
+        new = old - energy
+        self.nodes_energy[node] = new
+        self.residual_energy += max(new, 0) - max(old, 0)
+        if old > NODE_DEAD_ENERGY_THRESHOLD >= new:
+            self.alive_count -= 1
+            self.dead_nodes.add(node)
+            if not self.alive_count:  # drop the rounding left in the total
+                self.residual_energy = 0
+            for listener in self.death_listeners:
+                listener(self, node)
 
     def collect_once(self):
         consumption = 0
@@ -60,7 +123,7 @@ class Cluster(object):
 
         def sub_nodes_add_consum(i, v):
             nonlocal consumption
-            self.nodes_energy[i] -= v
+            self.deduct(i, v)
             consumption += v
 
         for i in self.nodes_energy:
@@ -107,7 +170,7 @@ class Cluster(object):
         return Eda * Tf * 0.005
 
     def formal_head_receive_consumption(self):
-        alive_node_count = len(self.nodes_energy) - self.count_dead_node()
+        alive_node_count = self.alive_count
         if alive_node_count <= 1:
             return 0
         return (alive_node_count - 1) * Ti * Pr
@@ -118,40 +181,59 @@ class Cluster(object):
     def formal_node_send_consumption(self, distance):
         return Ti * P0 * math.pow(distance, 1.5) * math.pow(a, distance)
 
+    def formal_node_send_consumptions(self, distances: np.ndarray):
+        """
+        formal_node_send_consumption over an array, equal to it up to the
+        last bit as numpy.power and math.pow may round differently.
+        """
+        return Ti * P0 * np.power(distances, 1.5) * np.power(a, distances)
+
     def formal_node_receive_broadcast_consumption(self):
         return Lb * Pr
 
     def count_dead_node(self):
-        s = 0
-        for _, e in self.nodes_energy.items():
-            if e <= NODE_DEAD_ENERGY_THRESHOLD:
-                s += 1
-        return s
+        return len(self.dead_nodes)
 
     def is_all_dead(self):
-        return self.count_dead_node() == len(self.nodes_energy)
+        return self.alive_count == 0
 
     def remain_energy(self):
-        r = 0
-        for _, e in self.nodes_energy.items():
-            if e > 0:
-                r += e
-        return r
+        return self.residual_energy
 
     def refresh_exclude_head_condidate(self, r):
-        if len(self.exclude_head_candidates) >= len(
-                self.nodes_energy) - self.count_dead_node():
+        if len(self.exclude_head_candidates) >= self.alive_count:
             self.exclude_head_candidates = set()
         if r % 10 == 0:
             self.exclude_head_candidates = set()
 
 
 class KMeansCluster(object):
-    def __init__(self, land, slop_threshold=0.008):
+    def __init__(self,
+                 land,
+                 slop_threshold=0.008,
+                 cache=None,
+                 search='linear',
+                 processes=1):
+        """
+        :param cache: keeps the elbow search of a landform and threshold, see uar.db.cache.cached;
+                      None to search every time
+        :param search: 'linear' - fit k = 1, 2, 3, ... in turn,
+                       'gallop' - double the step over k, then bisect, warm starting each fit
+        :param processes: fits run together by the gallop search
+        """
+        if search not in ['linear', 'gallop']:
+            raise ValueError('unknown search: {}'.format(search))
         self.nodes_coord = land.cities
         self.slop_threshold = slop_threshold
+        self.cache = cache
+        self.search = search
+        self.processes = processes
+        self.index = GridIndex(self.nodes_coord)
         self.kmeans = None
         self.clusters = []
+        self.dead_nodes = set()
+        self.headless = set()  # clusters whose head died in this round
+        self.death_listeners = []
         self.init_clusters(self.find_k_elbow())
 
     def init_clusters(self, k):
@@ -160,46 +242,95 @@ class KMeansCluster(object):
                     center_coord=self.kmeans.cluster_centers_[i])
             for i in range(k)
         ]
+        for c in self.clusters:
+            c.on_death(self.node_died)
         for i in range(len(self.nodes_coord)):
             label = self.kmeans.labels_[i]
             self.clusters[label].add_node(i)
         for c in self.clusters:
             self.find_head_center_nearest(c)
 
+    def on_death(self, listener):
+        """
+        :param listener: called as listener(cluster, node) when a node of any cluster dies
+        """
+        self.death_listeners.append(listener)
+
+    def node_died(self, cluster, node):
+        self.dead_nodes.add(node)
+        self.index.deactivate(node)
+        if node == cluster.head:
+            self.headless.add(cluster)
+        for listener in self.death_listeners:
+            listener(cluster, node)
+
     def find_head_stochastic(self, cluster, r):
-        if cluster.is_all_dead():
+        self.find_heads_stochastic(r, [cluster])
+
+    def find_heads_stochastic(self, r, clusters=None):
+        """
+        Elect the heads of several clusters with one weighted draw each,
+        thresholds computed for all their candidates together.
+        :param clusters: defaults to every cluster
+        """
+        clusters = [
+            c for c in (self.clusters if clusters is None else clusters)
+            if not c.is_all_dead()
+        ]
+        candidates = []
+        for c in clusters:
+            c.refresh_exclude_head_condidate(r)
+            candidates.append([
+                i for i, e in c.nodes_energy.items()
+                if e > NODE_DEAD_ENERGY_THRESHOLD
+                and i not in c.exclude_head_candidates
+            ])
+        nodes = np.array([i for group in candidates for i in group],
+                         dtype=int)
+        if not len(nodes):
             return
-        cluster.refresh_exclude_head_condidate(r)
-        while 1:
-            for i in cluster.nodes_energy:
-                if cluster.nodes_energy[i] <= NODE_DEAD_ENERGY_THRESHOLD:
-                    continue
-                if i in cluster.exclude_head_candidates:
-                    continue
-                d = distance(cluster.nodes_coord[i], cluster.center_coord)
-                if d == 0:
-                    d = 1
-                t = sigmoid_threshould(
-                    1 / d, cluster.nodes_energy[i] / NODE_INIT_ENERGY)
-                rdn = random.random()
-                if rdn <= t:
-                    cluster.head = i
-                    cluster.exclude_head_candidates.add(i)
-                    return
+        centers = np.repeat([c.center_coord for c in clusters],
+                            [len(group) for group in candidates],
+                            axis=0)
+        d = np.sqrt(((self.index.points[nodes] - centers)**2).sum(axis=1))
+        d[d == 0] = 1
+        energy = np.array([
+            c.nodes_energy[i] for c, group in zip(clusters, candidates)
+            for i in group
+        ])
+        t = sigmoid_threshoulds(1 / d, energy / NODE_INIT_ENERGY)
+        start = 0
+        for c, group in zip(clusters, candidates):
+            k = weighted_election(t[start:start + len(group)])
+            start += len(group)
+            if k < 0:  # nobody to elect, keep the head
+                continue
+            c.head = group[k]
+            c.exclude_head_candidates.add(c.head)
 
     def find_head_center_nearest(self, cluster):
         if cluster.is_all_dead():
             return
-        min_dis = -1
-        for i in cluster.nodes_energy:
-            if cluster.nodes_energy[i] <= NODE_DEAD_ENERGY_THRESHOLD:
-                continue
-            d = distance(cluster.nodes_coord[i], cluster.center_coord)
-            if min_dis == -1 or min_dis > d:
-                cluster.head = i
-                min_dis = d
+        mask = np.zeros(len(self.index), dtype=bool)
+        mask[list(cluster.nodes_energy)] = True
+        mask &= self.index.active
+        cluster.head = int(self.index.nearest(cluster.center_coord,
+                                              mask=mask)[0][0])
 
     def find_k_elbow(self):
+        def fit():
+            if self.search == 'gallop':
+                k = self.gallop_k_elbow()
+            else:
+                k = self.fit_k_elbow()
+            return k, self.kmeans
+
+        key = cache_key('k_elbow', np.asarray(self.nodes_coord),
+                        self.slop_threshold, self.search)
+        k, self.kmeans = cached(self.cache, key, fit)
+        return k
+
+    def fit_k_elbow(self):
         lki = KMeans(n_clusters=1).fit(self.nodes_coord).inertia_
         max_slope = 0
         i = 2
@@ -212,7 +343,104 @@ class KMeansCluster(object):
                 break
             lki = self.kmeans.inertia_
             i += 1
-        return i
+        return min(i, len(self.nodes_coord))  # never flattens, every node a cluster
+
+    def gallop_k_elbow(self):
+        """
+        Same stopping rule as fit_k_elbow, which holds from some k on as the
+        inertia gains shrink, so k is searched by doubling steps and then
+        bisection instead of one k after the other. Every round probes
+        GALLOP_BATCH values of k at once, spread over the process pool; the
+        rounds and the seed of each fit do not depend on processes, so
+        neither does the k found.
+        """
+        points = np.asarray(self.nodes_coord, dtype=float)
+        n = len(points)
+        fits = {}
+        seed = np.random.randint(2**31)  # follows numpy.random.seed
+        pool = mp.get_context().Pool(self.processes) \
+            if self.processes > 1 else None
+        try:
+            if n <= 2:
+                self._fit_k(points, fits, [n], seed, pool)
+                self.kmeans = fits[n]
+                return n
+            self._fit_k(points, fits, [1, 2], seed, pool)
+            first = fits[1].inertia_ - fits[2].inertia_
+
+            def first_below(ks):
+                """
+                :return: position in ks of the first k where the gain is below
+                         the threshold, len(ks) when there is none
+                """
+                self._fit_k(points, fits,
+                            sorted({j
+                                    for k in ks for j in (k - 1, k)}), seed,
+                            pool)
+                for i, k in enumerate(ks):
+                    if first == 0 or (fits[k - 1].inertia_ - fits[k].inertia_
+                                      ) / first < self.slop_threshold:
+                        return i
+                return len(ks)
+
+            lo, step, hi = 1, 1, None
+            while hi is None and lo < n:
+                ks = [lo]
+                while len(ks) <= GALLOP_BATCH and ks[-1] < n:
+                    step *= 2
+                    ks.append(min(ks[-1] + step - 1, n))
+                ks = ks[1:]
+                i = first_below(ks)
+                if i < len(ks):
+                    lo, hi = ([lo] + ks)[i], ks[i]
+                else:
+                    lo = ks[-1]
+            if hi is None:  # never flattens, use every node as a cluster
+                self._fit_k(points, fits, [n], seed, pool)
+                self.kmeans = fits[n]
+                return n
+            while hi - lo > 1:
+                ks = sorted(
+                    set(np.linspace(lo, hi, GALLOP_BATCH + 2)[1:-1].astype(int))
+                    - {lo})
+                i = first_below(ks)
+                lo, hi = ([lo] + ks)[i], (ks + [hi])[i]
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.kmeans = fits[hi]
+        return hi
+
+    def _fit_k(self, points, fits: dict, ks: list, seed: int, pool=None):
+        """
+        Fit the missing k of ks into fits, warm started from the centres of
+        the largest k fitted so far, over pool when given.
+        """
+        ks = [k for k in ks if k not in fits]
+        args = [(points, k, _warm_centers(points, fits, k), seed + k)
+                for k in ks]
+        if pool is not None and len(args) > 1:
+            results = pool.starmap(_fit_kmeans, args)
+        else:
+            results = [_fit_kmeans(*a) for a in args]
+        fits.update(zip(ks, results))
+
+    def engine(self):
+        """
+        EnergyEngine of the current clusters, heads and energies, for long
+        simulations. Its kmeans_collect_once stands for collect_once.
+        """
+        from uar.cluster.energy import EnergyEngine
+        labels = np.full(len(self.nodes_coord), -1)
+        energy = np.full(len(self.nodes_coord), float(NODE_INIT_ENERGY))
+        for k, c in enumerate(self.clusters):
+            nodes = list(c.nodes_energy)
+            labels[nodes] = k
+            energy[nodes] = list(c.nodes_energy.values())
+        return EnergyEngine(self.nodes_coord, labels,
+                            [c.head for c in self.clusters], energy,
+                            [c.center_coord for c in self.clusters])
 
     def show(self):
         plt.scatter([c[0] for c in self.nodes_coord],
@@ -231,7 +459,8 @@ class KMeansCluster(object):
             remain += c.remain_energy()
             dead_node_count += c.count_dead_node()
 
-            if c.nodes_energy[c.head] <= NODE_DEAD_ENERGY_THRESHOLD:
+            if c in self.headless:
+                self.headless.discard(c)
                 self.find_head_center_nearest(c)
         return consumption, remain, dead_node_count
 
@@ -243,14 +472,41 @@ class KMeansCluster(object):
             consumption += c.collect_once()
             remain += c.remain_energy()
             dead_node_count += c.count_dead_node()
-            self.find_head_stochastic(c, r)
+        self.headless.clear()
+        self.find_heads_stochastic(r)
         return consumption, remain, dead_node_count
 
 
+def _warm_centers(points: np.ndarray, fits: dict, k: int):
+    """
+    Centres of the largest fit below k, topped up with the points furthest
+    from every centre; None to let KMeans pick when nothing is fitted yet.
+    """
+    smaller = [j for j in fits if j < k]
+    if not smaller:
+        return None
+    centers = list(fits[max(smaller)].cluster_centers_)
+    d = np.min([((points - c)**2).sum(axis=1) for c in centers], axis=0)
+    while len(centers) < k:
+        far = int(np.argmax(d))
+        centers.append(points[far])
+        d = np.minimum(d, ((points - points[far])**2).sum(axis=1))
+    return np.array(centers)
+
+
+def _fit_kmeans(points: np.ndarray, k: int, init=None, seed=None):
+    model = MiniBatchKMeans if len(points) >= MINIBATCH_NODES else KMeans
+    if init is None:
+        return model(n_clusters=k, random_state=seed).fit(points)
+    return model(n_clusters=k, init=init, n_init=1,
+                 random_state=seed).fit(points)
+
+
 class LeachCluster(object):
     def __init__(self, land, p=0.1):
         self.p = p
         self.nodes_coord = land.cities
+        self.index = GridIndex(self.nodes_coord)
         self.nodes_energy = {
             i: NODE_INIT_ENERGY
             for i in range(len(self.nodes_coord))
@@ -258,6 +514,20 @@ class LeachCluster(object):
         self.exclude_head_candidates = set()
         self.all_dead = False
         self.alive_node_count = len(self.nodes_energy)
+        self.dead_nodes = set()
+        self.death_listeners = []
+
+    def on_death(self, listener):
+        """
+        :param listener: called as listener(cluster, node) when a node dies
+        """
+        self.death_listeners.append(listener)
+
+    def node_died(self, cluster, node):
+        self.dead_nodes.add(node)
+        self.alive_node_count -= 1
+        for listener in self.death_listeners:
+            listener(cluster, node)
 
     def cluster(self, r):
         if r % int(1 / self.p) == 0 or \
@@ -268,7 +538,7 @@ class LeachCluster(object):
         self.current_heads = set()
         while len(self.clusters) == 0:
             for i in range(len(self.nodes_coord)):
-                if self.nodes_energy[i] <= NODE_DEAD_ENERGY_THRESHOLD:
+                if i in self.dead_nodes:
                     continue
                 if i in self.exclude_head_candidates:
                     continue
@@ -277,22 +547,19 @@ class LeachCluster(object):
                 rdn = random.random()
                 if rdn <= t:
                     nc = Cluster(self.nodes_coord, head=i)
+                    nc.on_death(self.node_died)
                     nc.add_node(i, self.nodes_energy[i])
                     self.clusters.append(nc)
                     self.current_heads.add(i)
                     self.exclude_head_candidates.add(i)
 
-        for i in range(len(self.nodes_coord)):
-            if i in self.current_heads:
-                continue
-            tc = None
-            d = -1
-            for c in self.clusters:
-                cd = distance(self.nodes_coord[i], self.nodes_coord[c.head])
-                if d == -1 or cd < d:
-                    d = cd
-                    tc = c
-            tc.add_node(i, self.nodes_energy[i])
+        heads = np.zeros(len(self.nodes_coord), dtype=bool)
+        heads[list(self.current_heads)] = True
+        others = np.flatnonzero(~heads)
+        nearest, _ = self.index.nearest_each(self.index.points[others], heads)
+        clusters = {c.head: c for c in self.clusters}
+        for i, head in zip(others.tolist(), nearest.tolist()):
+            clusters[head].add_node(i, self.nodes_energy[i])
 
     def collect_once(self, r):
         if self.all_dead:
@@ -300,14 +567,12 @@ class LeachCluster(object):
         self.cluster(r)
         consumption = 0
         remain = 0
-        dead_node_count = 0
         for c in self.clusters:
-            consumption = c.collect_once()
+            consumption += c.collect_once()
             remain += c.remain_energy()
-            dead_node_count += c.count_dead_node()
 
             self.nodes_energy.update(c.nodes_energy)
-        self.alive_node_count = len(self.nodes_coord) - dead_node_count
+        dead_node_count = len(self.dead_nodes)
         if dead_node_count == len(self.nodes_coord):
             self.all_dead = True
         return consumption, remain, dead_node_count
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import pickle
+import time
+
+import numpy as np
+
+from uar.db import redis
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'uar')
+MAX_BYTES = 1 << 30
+REDIS_PREFIX = 'cache:'
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_versions = {}
+
+
+def code_version():
+    """
+    Hash of the package sources, so results of older code are never read back.
+    """
+    if 'code' not in _versions:
+        h = hashlib.sha1()
+        for root, dirs, files in os.walk(PACKAGE_DIR):
+            dirs[:] = sorted(d for d in dirs if not d.startswith(('.', '_')))
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    path = os.path.join(root, name)
+                    h.update(os.path.relpath(path, PACKAGE_DIR).encode())
+                    with open(path, 'rb') as f:
+                        h.update(f.read())
+        _versions['code'] = h.hexdigest()
+    return _versions['code']
+
+
+def cache_key(*parts, **named):
+    """
+    Hash of the inputs of a computation and of the code_version. Arrays, and
+    objects numpy can turn into arrays such as the matrices of
+    uar.route.matrix, are hashed by dtype, shape and content; lists, tuples
+    and dicts recursively.
+    """
+    h = hashlib.sha1(code_version().encode())
+    _update(h, parts)
+    _update(h, named)
+    return h.hexdigest()
+
+
+def _update(h, value):
+    if isinstance(value, dict):
+        h.update(b'{')
+        for k in sorted(value):
+            _update(h, k)
+            _update(h, value[k])
+        h.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        h.update(b'[')
+        for v in value:
+            _update(h, v)
+        h.update(b']')
+    elif value is None or isinstance(value, (str, bytes, int, float, bool)):
+        h.update(repr(value).encode())
+    else:
+        array = np.ascontiguousarray(np.asarray(value))
+        h.update('{}{}'.format(array.dtype.str, array.shape).encode())
+        h.update(array.tobytes())
+
+
+class DiskCache(object):
+    """
+    Pickled values in a directory, the least recently used dropped once the
+    files exceed max_bytes.
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key: str, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except OSError:
+            return default
+        except Exception:  # truncated, or pickled by incompatible code
+            os.remove(path)
+            return default
+        os.utime(path)  # mark as recently used
+        return value
+
+    def set(self, key: str, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+class RedisCache(object):
+    """
+    Pickled values in redis, shared by every machine of a sweep. A sorted set
+    of last use times drives the LRU eviction past max_bytes.
+    """
+    def __init__(self, client=None, max_bytes=MAX_BYTES, prefix=REDIS_PREFIX):
+        self.client = client or redis.redis_client()
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+
+    def get(self, key: str, default=None):
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return default
+        try:
+            value = pickle.loads(data)
+        except Exception:  # pickled by incompatible code
+            return default
+        self.client.zadd(self.prefix + 'used', {key: time.time()})
+        return value
+
+    def set(self, key: str, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, data)
+        pipe.zadd(self.prefix + 'used', {key: time.time()})
+        pipe.hset(self.prefix + 'sizes', key, len(data))
+        pipe.hvals(self.prefix + 'sizes')
+        total = sum(int(s) for s in pipe.execute()[-1])
+        while total > self.max_bytes:
+            oldest = self.client.zpopmin(self.prefix + 'used')
+            if not oldest:
+                break
+            old = oldest[0][0].decode()
+            total -= int(self.client.hget(self.prefix + 'sizes', old) or 0)
+            pipe = self.client.pipeline()
+            pipe.delete(self.prefix + old)
+            pipe.hdel(self.prefix + 'sizes', old)
+            pipe.execute()
+
+
+def cached(cache, key: str, compute):
+    """
+    :param cache: DiskCache, RedisCache or None to always compute
+    :param compute: called without arguments on a miss
+    """
+    if cache is None:
+        return compute()
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value)
+    return value
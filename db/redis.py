@@ -1,9 +1,71 @@
 #!/usr/local/bin/python3.8
+import numpy as np
 import redis
 
 PORT = 6379
 HOST = "0.0.0.0"
+LANDFORM_PREFIX = "landform:"
+UNAVAILABLE = (redis.ConnectionError, redis.TimeoutError)
 
+_pools = {}
 
-def redis_client(host=PORT, port=HOST):
-    return redis.Redis(host=host, port=port)
+
+def connection_pool(host=HOST, port=PORT, db=0):
+    """
+    One pool per server, shared by every client of the process.
+    """
+    key = (host, port, db)
+    if key not in _pools:
+        _pools[key] = redis.ConnectionPool(host=host, port=port, db=db)
+    return _pools[key]
+
+
+def redis_client(host=HOST, port=PORT, db=0):
+    return redis.Redis(connection_pool=connection_pool(host, port, db))
+
+
+def save_landform(key: str, land_map, cities, client=None):
+    """
+    Store a landform as a hash: the obstacle cells bit-packed and the cities
+    as a packed uint32 array.
+    :param land_map: LandForm.map
+    :param cities: LandForm.cities
+    """
+    client = client or redis_client()
+    land_map = np.asarray(land_map)
+    client.hset(LANDFORM_PREFIX + key,
+                mapping={
+                    'shape': '{},{}'.format(*land_map.shape),
+                    'obstacles': np.packbits(land_map == 2).tobytes(),
+                    'cities': np.asarray(cities, dtype='<u4').tobytes(),
+                })
+
+
+def load_landform(key: str, client=None):
+    """
+    :return: (map, cities) as stored by save_landform, None when missing
+    """
+    return load_landforms([key], client)[0]
+
+
+def load_landforms(keys: list, client=None):
+    """
+    Load many landforms in one round trip.
+    :return: list of (map, cities) or None for the missing keys
+    """
+    client = client or redis_client()
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(LANDFORM_PREFIX + key)
+    return [_decode_landform(h) if h else None for h in pipe.execute()]
+
+
+def _decode_landform(fields: dict):
+    length, width = [int(s) for s in fields[b'shape'].split(b',')]
+    obstacles = np.unpackbits(np.frombuffer(fields[b'obstacles'],
+                                            dtype=np.uint8),
+                              count=length * width)
+    land_map = obstacles.reshape(length, width) * np.uint8(2)
+    cities = np.frombuffer(fields[b'cities'], dtype='<u4').reshape(-1, 2)
+    land_map[cities[:, 0], cities[:, 1]] = 1
+    return land_map, cities.astype(int).tolist()
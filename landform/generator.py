@@ -1,8 +1,33 @@
 #!/usr/local/bin/python3.8
-import random
+import numpy as np
 
 from uar.db import redis
 
+BLOCK_ROWS = 1024  # rows drawn together, bounds the temporary arrays
+EMPTY, CITY, OBSTACLE = 0, 1, 2
+
+
+def stamp_obstacles(obstacles: np.ndarray, top: int, bottom: int, left: int,
+                    right: int):
+    """
+    Cells of the window [top, bottom) x [left, right) inside any obstacle,
+    stamped on a difference array and summed up.
+    :param obstacles: (row, column, rows, columns) of each obstacle
+    :return: boolean array of the window
+    """
+    oi, oj, ol, ow = obstacles.T
+    t, b = np.maximum(oi, top), np.minimum(oi + ol, bottom)
+    l, r = np.maximum(oj, left), np.minimum(oj + ow, right)
+    keep = (t < b) & (l < r)
+    t, b = t[keep] - top, b[keep] - top
+    l, r = l[keep] - left, r[keep] - left
+    diff = np.zeros((bottom - top + 1, right - left + 1), dtype=np.int32)
+    np.add.at(diff, (t, l), 1)
+    np.add.at(diff, (t, r), -1)
+    np.add.at(diff, (b, l), -1)
+    np.add.at(diff, (b, r), 1)
+    return diff.cumsum(axis=0).cumsum(axis=1)[:-1, :-1] > 0
+
 
 class LandForm(object):
     def __init__(self,
@@ -10,47 +35,78 @@ class LandForm(object):
                  width=0,
                  use_old=True,
                  obstacle_rate=0.01,
-                 city_rate=0.008):
-        # if use_old == True:
-        #     db_cli = redis.redis_client()
-
+                 city_rate=0.008,
+                 seed=None):
+        """
+        Grid of EMPTY/CITY/OBSTACLE cells. Every cell becomes a city with
+        probability city_rate, otherwise starts a rectangular obstacle to its
+        lower right with probability obstacle_rate. Cities covered by an
+        obstacle are dropped.
+        :param use_old: with an int seed, load the landform from the redis store when it
+                        was generated before, and store it otherwise. Skipped when redis is down.
+        :param seed: seed of the random generator, same meaning as numpy.random.default_rng
+        """
         self.length = length
         self.width = width
-        self.map = [[0 for j in range(width)] for i in range(length)]
+        self.rng = np.random.default_rng(seed)
+        self.key = None
+        if use_old and isinstance(seed, int):
+            self.key = '{}x{}:{}:{}:{}'.format(length, width, obstacle_rate,
+                                               city_rate, seed)
+            try:
+                stored = redis.load_landform(self.key)
+            except redis.UNAVAILABLE:
+                stored, self.key = None, None
+            if stored is not None:
+                self.map, self.cities = stored
+                return
+        self.generate(obstacle_rate, city_rate)
+        if self.key is not None:
+            redis.save_landform(self.key, self.map, self.cities)
+
+    def generate(self, obstacle_rate, city_rate):
+        length, width = self.length, self.width
+        self.map = np.zeros((length, width), dtype=np.uint8)
         self.cities = []
-        for i in range(length):
-            for j in range(width):
-                if random.random() <= city_rate:
-                    if self.map[i][j] != 0:
-                        continue
-                    self.cities.append([i, j])
-                    self.map[i][j] = 1
-                elif random.random() <= obstacle_rate:
-                    ol, ow = self.obstacle_shap(length, width)
-                    for oi in range(i, i + ol):
-                        if oi >= length:
-                            break
-                        for oj in range(j, j + ow):
-                            if oj >= width:
-                                break
-                            self.map[oi][oj] = 2
-
-    def obstacle_shap(self, length, width):
+        # obstacles reaching the next block, as (row, column, rows, columns)
+        obstacles = np.empty((0, 4), dtype=np.int64)
+        for start in range(0, length, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, length)
+            city = self.rng.random((stop - start, width)) <= city_rate
+            origin = ~city & (self.rng.random(
+                (stop - start, width)) <= obstacle_rate)
+            oi, oj = np.nonzero(origin)
+            ol, ow = self.obstacle_shap(length, width, len(oi))
+            obstacles = np.concatenate(
+                [obstacles,
+                 np.stack([oi + start, oj, ol, ow], axis=1)])
+            covered = stamp_obstacles(obstacles, start, stop, 0, width)
+            obstacles = obstacles[obstacles[:, 0] + obstacles[:, 2] > stop]
+            block = self.map[start:stop]
+            block[covered] = OBSTACLE
+            city &= ~covered
+            block[city] = CITY
+            ci, cj = np.nonzero(city)
+            self.cities.extend(np.stack([ci + start, cj], axis=1).tolist())
+
+    def obstacle_shap(self, length, width, count=None):
+        """
+        :param count: number of shapes to draw, a single (l, w) when None
+        :return: obstacle rows and columns
+        """
         ld = length // 17
         wd = width // 17
 
-        l = ld
-        w = wd
-        for _ in range(3):
-            if random.random() < 0.01:
-                l += ld
-            if random.random() < 0.01:
-                w += wd
+        size = 1 if count is None else count
+        l = ld * (1 + self.rng.binomial(3, 0.01, size))
+        w = wd * (1 + self.rng.binomial(3, 0.01, size))
+        if count is None:
+            return int(l[0]), int(w[0])
         return l, w
 
 
 if __name__ == "__main__":
     l = LandForm(200, 200)
     for i in range(l.length):
-        print(l.map[i])
+        print(l.map[i].tolist())
     print(l.cities)
@@ -0,0 +1,228 @@
+import math
+
+import numpy as np
+
+SPARSE = 4  # nearest_each regrids the points it searches when fewer than 1 in SPARSE qualify
+BRUTE_FORCE = 1 << 16  # distances worth computing directly to save one more ring
+RING_SLOT = 4
+CHUNK = 1 << 20  # points nearest_each compares at once
+
+
+def _ring(radius: int):
+    """
+    Cell offsets exactly radius cells away, i.e. the border of a square.
+    """
+    if radius == 0:
+        return [(0, 0)]
+    side = range(-radius, radius)
+    return [(-radius, d) for d in side] + [(d, radius) for d in side] + \
+        [(radius, -d) for d in side] + [(-d, -radius) for d in side]
+
+
+class GridIndex(object):
+    """
+    Uniform grid hash over a fixed set of points, e.g. LandForm.cities.
+    Points can be switched off and on, for dead nodes or to search among
+    cluster heads only, without rebuilding the grid.
+    """
+    def __init__(self, points, cell_size: float = None):
+        """
+        :param points: (n, 2) coordinates
+        :param cell_size: side of a grid cell, defaults to about one point per cell
+        """
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        n = len(self.points)
+        self.low = self.points.min(axis=0) if n else np.zeros(2)
+        extent = (self.points.max(axis=0) - self.low) if n else np.zeros(2)
+        if cell_size is None:
+            cell_size = math.sqrt(max(extent[0], 1) * max(extent[1], 1) /
+                                  max(n, 1))
+        self.cell_size = cell_size
+        self.shape = tuple((extent // cell_size).astype(int) + 1)
+        cells = self._cells(self.points)
+        ids = cells[:, 0] * self.shape[1] + cells[:, 1]
+        # points sorted by cell, cell c holds order[offsets[c]:offsets[c + 1]]
+        self.order = np.argsort(ids, kind='stable')
+        self.offsets = np.searchsorted(ids[self.order],
+                                       np.arange(self.shape[0] *
+                                                 self.shape[1] + 1))
+        self.bounds = self.offsets.tolist()  # the same, for scalar lookups
+        self.active = np.ones(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cells(self, points: np.ndarray):
+        cells = ((points - self.low) // self.cell_size).astype(int)
+        return np.clip(cells, 0, np.array(self.shape) - 1)
+
+    def _locate(self, point: np.ndarray):
+        """
+        :return: (row, column, how far the point lies outside that cell)
+        """
+        ci, cj = self._cells(point[None])[0]
+        cell_low = self.low + np.array([ci, cj]) * self.cell_size
+        gap = np.maximum(
+            np.maximum(cell_low - point, point - cell_low - self.cell_size), 0)
+        return ci, cj, float(np.sqrt((gap**2).sum()))
+
+    def _gather(self, cells: np.ndarray):
+        """
+        Points of many cells in one pass.
+        :return: (position in cells of the cell of each point, point indices)
+        """
+        starts = self.offsets[cells]
+        counts = self.offsets[cells + 1] - starts
+        owner = np.repeat(np.arange(len(cells)), counts)
+        slot = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts,
+                                                 counts)
+        return owner, self.order[np.repeat(starts, counts) + slot]
+
+    def deactivate(self, indices):
+        self.active[indices] = False
+
+    def activate(self, indices):
+        self.active[indices] = True
+
+    def _square(self, ci: int, cj: int, radius: int, ring_only: bool):
+        """
+        Indices of the points in the cells at most radius cells from (ci, cj),
+        or exactly radius cells away when ring_only.
+        """
+        rows, columns = self.shape
+        left, right = max(cj - radius, 0), min(cj + radius, columns - 1)
+        parts = []
+        for i in range(max(ci - radius, 0), min(ci + radius, rows - 1) + 1):
+            base = i * columns
+            if not ring_only or abs(i - ci) == radius:
+                parts.append(self.order[self.bounds[base + left]:self.
+                                        bounds[base + right + 1]])
+                continue
+            for j in {cj - radius, cj + radius}:
+                if 0 <= j < columns:
+                    parts.append(self.order[self.bounds[base + j]:self.
+                                            bounds[base + j + 1]])
+        return np.concatenate(parts) if parts else np.empty(0, dtype=int)
+
+    def nearest(self, point, k: int = 1, mask: np.ndarray = None):
+        """
+        k nearest points, ties broken by the lower index.
+        :param mask: boolean array of the points to consider, defaults to the active ones
+        :return: (indices, distances) sorted by distance, fewer than k when not enough points qualify
+        """
+        mask = self.active if mask is None else mask
+        point = np.asarray(point, dtype=float)
+        ci, cj, outside = self._locate(point)
+        limit = max(ci, cj, self.shape[0] - 1 - ci, self.shape[1] - 1 - cj)
+        found = np.empty(0, dtype=int)
+        for radius in range(limit + 1):
+            ring = self._square(ci, cj, radius, True)
+            found = np.concatenate([found, ring[mask[ring]]])
+            if len(found) < k:
+                continue
+            d = np.sqrt(((self.points[found] - point)**2).sum(axis=1))
+            # everything outside the square is further than radius cells
+            if np.partition(d, k - 1)[k - 1] < \
+                    radius * self.cell_size - outside:
+                break
+        d = np.sqrt(((self.points[found] - point)**2).sum(axis=1))
+        order = np.lexsort((found, d))[:k]
+        return found[order], d[order]
+
+    def nearest_each(self, points, mask: np.ndarray = None):
+        """
+        Nearest point to each of many points, searched ring by ring for all
+        of them together.
+        :param mask: boolean array of the points to consider, defaults to the active ones
+        :return: (indices, distances), -1 and inf where no point qualifies
+        """
+        mask = self.active if mask is None else mask
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        chosen = np.flatnonzero(mask)
+        if 0 < len(chosen) * SPARSE < len(self):
+            # rings would have to grow far, search a grid of the chosen points
+            best, best_d = GridIndex(self.points[chosen]).nearest_each(points)
+            return chosen[best], best_d
+        cells = self._cells(points)
+        cell_low = self.low + cells * self.cell_size
+        gap = np.maximum(
+            np.maximum(cell_low - points, points - cell_low - self.cell_size),
+            0)
+        outside = np.sqrt((gap**2).sum(axis=1))
+        best = np.full(len(points), -1)
+        best_d = np.full(len(points), np.inf)
+        open_ = np.arange(len(points) if len(chosen) else 0)
+        per_cell = len(self) / (len(self.offsets) - 1)
+        x, y = self.points.T
+        for radius in range(max(self.shape) if len(open_) else 0):
+            # cost per query of the rings so far, a point read in a ring
+            # costing about RING_SLOT direct distances
+            read = (2 * radius + 1)**2 * per_cell * RING_SLOT
+            if len(open_) * (len(chosen) - read) <= BRUTE_FORCE * radius:
+                # few or far queries left, cheaper to compare with every point
+                rows = max(CHUNK // len(chosen), 1)
+                for q in np.array_split(open_, -(-len(open_) // rows)):
+                    d = np.sqrt((x[chosen] - points[q, :1])**2 +
+                                (y[chosen] - points[q, 1:])**2)
+                    k = np.argmin(d, axis=1)  # first minimum, lowest index
+                    best[q] = chosen[k]
+                    best_d[q] = d[np.arange(len(q)), k]
+                break
+            ring = np.array(_ring(radius))
+            ci = cells[open_, :1] + ring[:, 0]
+            cj = cells[open_, 1:] + ring[:, 1]
+            inside = (ci >= 0) & (ci < self.shape[0]) & \
+                (cj >= 0) & (cj < self.shape[1])
+            ring_cells = (ci * self.shape[1] + cj)[inside]
+            asking = np.repeat(open_, inside.sum(axis=1))
+            # bound the points compared at once, clustered cells hold many
+            counts = self.offsets[ring_cells + 1] - self.offsets[ring_cells]
+            chunks = np.searchsorted(np.cumsum(counts),
+                                     np.arange(1, -(-counts.sum() // CHUNK)) *
+                                     CHUNK)
+            for part in np.split(np.arange(len(ring_cells)), chunks):
+                owner, found = self._gather(ring_cells[part])
+                q = asking[part][owner]
+                keep = mask[found]
+                q, found = q[keep], found[keep]
+                if not len(q):
+                    continue
+                d = np.sqrt((x[found] - points[q, 0])**2 +
+                            (y[found] - points[q, 1])**2)
+                # group by query, then the nearest and lowest index of each
+                order = np.argsort(q, kind='stable')
+                q, found, d = q[order], found[order], d[order]
+                starts = np.flatnonzero(np.append(True, q[1:] != q[:-1]))
+                q = q[starts]
+                d_min = np.minimum.reduceat(d, starts)
+                found = np.minimum.reduceat(
+                    np.where(d == np.repeat(d_min, np.diff(
+                        np.append(starts, len(d)))), found, len(self)),
+                    starts)
+                better = (d_min < best_d[q]) | (d_min == best_d[q]) & \
+                    (found < best[q])
+                best[q[better]] = found[better]
+                best_d[q[better]] = d_min[better]
+            open_ = open_[best_d[open_] >= radius * self.cell_size -
+                          outside[open_]]
+            if not len(open_):
+                break
+        return best, best_d
+
+    def within(self, point, radius: float, mask: np.ndarray = None):
+        """
+        Points at most radius away, nearest first.
+        :param mask: boolean array of the points to consider, defaults to the active ones
+        :return: (indices, distances)
+        """
+        mask = self.active if mask is None else mask
+        point = np.asarray(point, dtype=float)
+        ci, cj, outside = self._locate(point)
+        found = self._square(ci, cj,
+                             int((radius + outside) // self.cell_size) + 1,
+                             False)
+        found = found[mask[found]]
+        d = np.sqrt(((self.points[found] - point)**2).sum(axis=1))
+        keep = d <= radius
+        order = np.lexsort((found[keep], d[keep]))
+        return found[keep][order], d[keep][order]
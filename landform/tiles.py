@@ -0,0 +1,145 @@
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from uar.landform.generator import CITY, OBSTACLE, stamp_obstacles
+
+ORIGIN_STREAM, CITY_STREAM = 0, 1
+
+
+class TiledLandForm(object):
+    """
+    LandForm of any size, kept in a memory-mapped file and generated one tile
+    at a time when first accessed. Every tile is drawn from (seed, tile row,
+    tile column) only, so any region can be regenerated on its own.
+    Obstacles start in a tile and may reach into the tiles below and to the
+    right of it.
+    """
+    def __init__(self,
+                 length: int,
+                 width: int,
+                 path: str,
+                 tile_size=1024,
+                 seed=None,
+                 obstacle_rate=0.01,
+                 city_rate=0.008,
+                 obstacle_size=None,
+                 cache_tiles=64):
+        """
+        :param path: map file, created when missing. A `.tiles` sidecar records the generated tiles.
+                     Reopen an existing file with the same parameters.
+        :param seed: int seed of the terrain, a random one is picked and kept in self.seed when None
+        :param obstacle_size: (rows, columns) of a basic obstacle, defaults to 1/17 of the map as in LandForm
+        :param cache_tiles: number of tiles whose obstacle origins are kept
+        """
+        self.length = length
+        self.width = width
+        self.path = path
+        self.tile_size = tile_size
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.obstacle_rate = obstacle_rate
+        self.city_rate = city_rate
+        self.obstacle_size = obstacle_size or (length // 17, width // 17)
+        self.cache_tiles = cache_tiles
+        self.tiles = (math.ceil(length / tile_size),
+                      math.ceil(width / tile_size))
+        # obstacles grow up to four basic sizes, see LandForm.obstacle_shap
+        self.reach = tuple(
+            math.ceil(4 * s / tile_size) for s in self.obstacle_size)
+
+        mode = 'r+' if os.path.exists(path) else 'w+'
+        self.map = np.memmap(path,
+                             dtype=np.uint8,
+                             mode=mode,
+                             shape=(length, width))
+        self.generated = np.memmap(path + '.tiles',
+                                   dtype=np.uint8,
+                                   mode=mode,
+                                   shape=self.tiles)
+        self._origins = OrderedDict()
+
+    def _rng(self, ti: int, tj: int, stream: int):
+        return np.random.default_rng([self.seed, ti, tj, stream])
+
+    def _bounds(self, ti: int, tj: int):
+        top, left = ti * self.tile_size, tj * self.tile_size
+        return (top, min(top + self.tile_size, self.length), left,
+                min(left + self.tile_size, self.width))
+
+    def origins(self, ti: int, tj: int):
+        """
+        Obstacles starting in a tile.
+        :return: (row, column, rows, columns) array in map coordinates
+        """
+        key = ti, tj
+        if key in self._origins:
+            self._origins.move_to_end(key)
+            return self._origins[key]
+        top, bottom, left, right = self._bounds(ti, tj)
+        rng = self._rng(ti, tj, ORIGIN_STREAM)
+        oi, oj = np.nonzero(
+            rng.random((bottom - top, right - left)) <= self.obstacle_rate)
+        ld, wd = self.obstacle_size
+        ol = ld * (1 + rng.binomial(3, 0.01, len(oi)))
+        ow = wd * (1 + rng.binomial(3, 0.01, len(oi)))
+        obstacles = np.stack([oi + top, oj + left, ol, ow], axis=1)
+        self._origins[key] = obstacles
+        if len(self._origins) > self.cache_tiles:
+            self._origins.popitem(last=False)
+        return obstacles
+
+    def tile(self, ti: int, tj: int):
+        """
+        :return: view of the tile in self.map, generated on first access
+        """
+        top, bottom, left, right = self._bounds(ti, tj)
+        view = self.map[top:bottom, left:right]
+        if self.generated[ti, tj]:
+            return view
+        obstacles = np.concatenate([
+            self.origins(ui, uj)
+            for ui in range(max(ti - self.reach[0], 0), ti + 1)
+            for uj in range(max(tj - self.reach[1], 0), tj + 1)
+        ])
+        covered = stamp_obstacles(obstacles, top, bottom, left, right)
+        city = self._rng(ti, tj, CITY_STREAM).random(
+            view.shape) <= self.city_rate
+        view[:] = 0
+        view[covered] = OBSTACLE
+        view[city & ~covered] = CITY
+        self.generated[ti, tj] = 1
+        return view
+
+    def region(self, top: int, bottom: int, left: int, right: int):
+        """
+        :return: view of the cells [top, bottom) x [left, right), generating the tiles it touches
+        """
+        for ti in range(top // self.tile_size,
+                        math.ceil(bottom / self.tile_size)):
+            for tj in range(left // self.tile_size,
+                            math.ceil(right / self.tile_size)):
+                self.tile(ti, tj)
+        return self.map[top:bottom, left:right]
+
+    def generate(self):
+        """
+        Generate every missing tile.
+        """
+        self.region(0, self.length, 0, self.width)
+        self.flush()
+
+    def iter_cities(self):
+        """
+        Yield [i, j] of every city, tile by tile, generating tiles as it goes.
+        """
+        for ti in range(self.tiles[0]):
+            for tj in range(self.tiles[1]):
+                top, _, left, _ = self._bounds(ti, tj)
+                for i, j in np.argwhere(self.tile(ti, tj) == CITY).tolist():
+                    yield [i + top, j + left]
+
+    def flush(self):
+        self.map.flush()
+        self.generated.flush()
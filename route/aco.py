@@ -1,4 +1,38 @@
+import heapq
 import random
+import time
+
+import numpy as np
+
+from uar.route import localsearch
+from uar.route.matrix import CondensedMatrix, LazyDistanceMatrix
+
+GAMA = 0.06  # decay of the backward-propagated deposit (strategies 3/4)
+ANGLE_ETA_WEIGHT = 0.012  # weight of the angle term in the heuristic
+ANGLE_Q = 13  # angle pheromone intensity (strategies 3/4)
+MMAS_P_BEST = 0.05  # chance to rebuild the best tour once converged, sets tau_min (strategy 5)
+MMAS_GLOBAL_INTERVAL = 5  # every this many generations MMAS deposits the best-so-far tour
+MMAS_RESTART_BRANCHING = 1.1  # branching factor counted as converged
+MMAS_RESTART_STAGNATION = 25  # generations without a better tour before a restart
+ACS_Q0 = 0.9  # chance of the greedy move in ACS (strategy 6)
+ACS_XI = 0.1  # local pheromone decay in ACS
+
+
+def require_dense(graph):
+    """
+    The solvers hold n x n pheromone and heuristic arrays whatever the form
+    of the costs, so a CondensedMatrix or LazyDistanceMatrix would only be
+    expanded behind the caller's back. Refuse them instead.
+    """
+    for name, matrix in (('cost', graph.matrix), ('angle',
+                                                   graph.angle_matrix)):
+        if isinstance(matrix, (CondensedMatrix, LazyDistanceMatrix)):
+            raise ValueError(
+                'the {} matrix is a {} of rank {}, the solvers need it dense: '
+                'pass numpy.asarray(matrix) if {} x {} values fit in memory'.
+                format(name,
+                       type(matrix).__name__, len(matrix), len(matrix),
+                       len(matrix)))
 
 
 class Graph(object):
@@ -13,11 +47,186 @@ class Graph(object):
         # noinspection PyUnusedLocal
         self.pheromone = [[1 / (rank * rank) for j in range(rank)]
                           for i in range(rank)]
+        self.choice_info = None
+        self._expected_pheromone = None
+        self._heuristic = {}
+        self._neighbours = {}
+
+    def heuristic(self, angle_weight: float = 0):
+        """
+        Heuristic information, built once per graph and weight.
+        :param angle_weight: weight of the angle term, 0 to ignore angles
+        """
+        if angle_weight not in self._heuristic and isinstance(
+                self.matrix, np.ndarray):
+            with np.errstate(divide='ignore'):
+                eta = 1 / self.matrix.astype(float)
+                if angle_weight:
+                    eta += angle_weight / np.asarray(self.angle_matrix,
+                                                     dtype=float)
+            np.fill_diagonal(eta, 0)
+            self._heuristic[angle_weight] = eta
+        if angle_weight not in self._heuristic:
+            eta = []
+            for i in range(self.rank):
+                row = []
+                for j in range(self.rank):
+                    if i == j:
+                        row.append(0)
+                        continue
+                    v = 1 / self.matrix[i][j]
+                    if angle_weight:
+                        v += angle_weight / self.angle_matrix[i][j]
+                    row.append(v)
+                eta.append(row)
+            self._heuristic[angle_weight] = eta
+        return self._heuristic[angle_weight]
+
+    def _eta(self, cost, angle_cost, angle_weight):
+        v = 1 / cost
+        if angle_weight:
+            v += angle_weight / angle_cost
+        return v
+
+    def add_node(self, costs, angle_costs, pheromone: float = None):
+        """
+        Add a node in place, keeping the pheromone and heuristic of the others.
+        Costs are symmetric.
+        :param costs: cost between the new node and each existing node
+        :param angle_costs: angle cost between the new node and each existing node
+        :param pheromone: initial pheromone of its edges, defaults to the current mean
+        :return: index of the new node
+        """
+        self._editable()
+        if pheromone is None:
+            pheromone = float(np.mean(self.pheromone))
+        self.matrix = _grow(self.matrix, costs)
+        self.angle_matrix = _grow(self.angle_matrix, angle_costs)
+        self.pheromone = _grow(self.pheromone, [pheromone] * self.rank,
+                               pheromone)
+        for w, eta in self._heuristic.items():
+            self._heuristic[w] = _grow(eta, [
+                self._eta(c, a, w) for c, a in zip(costs, angle_costs)
+            ])
+        self.rank += 1
+        self._changed()
+        return self.rank - 1
+
+    def remove_node(self, node: int):
+        """
+        Remove a node in place, the nodes after it shift down by one index.
+        """
+        self._editable()
+        self.matrix = _shrink(self.matrix, node)
+        self.angle_matrix = _shrink(self.angle_matrix, node)
+        self.pheromone = _shrink(self.pheromone, node)
+        for w, eta in self._heuristic.items():
+            self._heuristic[w] = _shrink(eta, node)
+        self.rank -= 1
+        self._changed()
+
+    def update_cost(self, i: int, j: int, cost: float, angle_cost=None):
+        """
+        Change the cost of the edge between i and j, in both directions.
+        """
+        self._editable()
+        if angle_cost is None:
+            angle_cost = self.angle_matrix[i][j]
+        for a, b in [(i, j), (j, i)]:
+            self.matrix[a][b] = cost
+            self.angle_matrix[a][b] = angle_cost
+            for w, eta in self._heuristic.items():
+                eta[a][b] = self._eta(cost, angle_cost, w)
+        self._changed()
+
+    def _editable(self):
+        """
+        Float copies of integer matrices before an in place edit. Condensed or
+        lazy matrices are refused, as the solvers refuse them.
+        """
+        require_dense(self)
+        for name in ['matrix', 'angle_matrix', 'pheromone']:
+            m = getattr(self, name)
+            if not isinstance(m, (list, np.ndarray)) or (
+                    isinstance(m, np.ndarray) and m.dtype.kind != 'f'):
+                setattr(self, name, np.asarray(m, dtype=float))
+
+    def _changed(self):
+        self.choice_info = None
+        self._expected_pheromone = None
+        self._neighbours = {}
+
+    def nearest_neighbours(self, k: int):
+        """
+        Candidate lists, the k nearest nodes of each node ordered by cost.
+        """
+        if k not in self._neighbours:
+            self._neighbours[k] = [
+                heapq.nsmallest(k, (j for j in range(self.rank) if j != i),
+                                key=self.matrix[i].__getitem__)
+                for i in range(self.rank)
+            ]
+        return self._neighbours[k]
+
+    def update_choice_info(self, alpha: float, beta: float,
+                           angle_weight: float = 0):
+        """
+        Refresh pheromone ** alpha * eta ** beta, shared by all ants of a generation.
+        """
+        eta = self.heuristic(angle_weight)
+        self.choice_info = [[
+            tau**alpha * e**beta for tau, e in zip(tau_row, eta_row)
+        ] for tau_row, eta_row in zip(self.pheromone, eta)]
+        self._expected_pheromone = None
+
+    def expected_pheromone(self):
+        """
+        Pheromone expected on the edge leading into each node under the
+        current choice info, computed once per generation.
+        """
+        if self._expected_pheromone is None:
+            denominators = [0] * self.rank
+            expected = [0] * self.rank
+            for choice_row, tau_row in zip(self.choice_info, self.pheromone):
+                for i in range(self.rank):
+                    denominators[i] += choice_row[i]
+                    expected[i] += choice_row[i] * tau_row[i]
+            self._expected_pheromone = [
+                e / d if d else 0 for e, d in zip(expected, denominators)
+            ]
+        return self._expected_pheromone
+
+
+def _grow(matrix, row, diagonal=0):
+    if isinstance(matrix, np.ndarray):
+        rank = len(matrix)
+        grown = np.empty((rank + 1, rank + 1), dtype=matrix.dtype)
+        grown[:rank, :rank] = matrix
+        grown[rank, :rank] = row
+        grown[:rank, rank] = row
+        grown[rank, rank] = diagonal
+        return grown
+    for r, v in zip(matrix, row):
+        r.append(v)
+    matrix.append(list(row) + [diagonal])
+    return matrix
+
+
+def _shrink(matrix, node: int):
+    if isinstance(matrix, np.ndarray):
+        keep = np.arange(len(matrix)) != node
+        return matrix[np.ix_(keep, keep)]
+    del matrix[node]
+    for r in matrix:
+        del r[node]
+    return matrix
 
 
 class ACO(object):
     def __init__(self, ant_count: int, generations: int, alpha: float,
-                 beta: float, rho: float, q: int, strategy: int):
+                 beta: float, rho: float, q: int, strategy: int,
+                 candidate_count: int = 0,
+                 local_search: str = None):
         """
         :param ant_count:
         :param generations:
@@ -25,7 +234,10 @@ class ACO(object):
         :param beta: relative importance of heuristic information
         :param rho: pheromone residual coefficient
         :param q: pheromone intensity
-        :param strategy: pheromone update strategy. 0 - ant-cycle, 1 - ant-quality, 2 - ant-density, 3 - bellman
+        :param strategy: pheromone update strategy. 0 - ant-cycle, 1 - ant-quality, 2 - ant-density, 3 - bellman, 4 - r-aco,
+                         5 - max-min ant system, 6 - ant colony system
+        :param candidate_count: only choose among this many nearest neighbours, 0 to consider every node
+        :param local_search: 2-opt/Or-opt the tours before the pheromone update. None - off, 'ants' - every tour, 'best' - iteration best
         """
         self.Q = q
         self.rho = rho
@@ -34,55 +246,305 @@ class ACO(object):
         self.ant_count = ant_count
         self.generations = generations
         self.update_strategy = strategy
+        self.candidate_count = candidate_count
+        self.local_search = local_search
+        self.angle_eta_weight = ANGLE_ETA_WEIGHT if strategy in [3, 4] else 0
+        self.p_best = MMAS_P_BEST
+        self.q0 = ACS_Q0 if strategy == 6 else 0
+        self.xi = ACS_XI
+        self.tau_min = None
+        self.tau_max = None
+        self.tau0 = None
+        self._restarted = 0  # len(round_best_cost) at the last MMAS restart
 
         self.round_costs_mean = []
         self.round_angle_costs_mean = []
         self.round_best_cost = []
         self.round_angle_cost = []
 
+        self.best_solution = []
+        self.best_cost = float('inf')
+        self.best_angle_cost = float('inf')
+        self.stop_reason = None
+
     def _update_pheromone(self, graph: Graph, ants: list):
-        for i, row in enumerate(graph.pheromone):
-            for j, col in enumerate(row):
-                graph.pheromone[i][j] *= self.rho
-                for ant in ants:
-                    graph.pheromone[i][j] += ant.pheromone_delta[i][j]
+        if self.update_strategy == 5:
+            best = min(ants, key=lambda a: a.total_cost)
+            self._update_mmas(graph, best.tabu, best.total_cost)
+            return
+        if self.update_strategy == 6:
+            self._update_acs(graph)
+            return
+        for row in graph.pheromone:
+            row[:] = [tau * self.rho for tau in row]
+        for ant in ants:
+            for i, j, amount in ant.pheromone_delta:
+                graph.pheromone[i][j] += amount
 
-    # noinspection PyProtectedMember
-    def solve(self, graph: Graph):
+    def _update_mmas(self, graph: Graph, tour: list, cost: float):
+        """
+        Evaporate, deposit a single tour and clamp to [tau_min, tau_max].
+        :param tour: iteration best tour, replaced by the best-so-far one
+                     every MMAS_GLOBAL_INTERVAL generations
+        """
+        if len(self.round_best_cost) % MMAS_GLOBAL_INTERVAL == 0:
+            tour, cost = self.best_solution, self.best_cost
+        first = self.tau_max is None
+        self._mmas_limits(graph)
+        if first or self._mmas_stagnant(graph):
+            self._fill_pheromone(graph, self.tau_max)
+            return
+        self._mmas_deposit(graph, tour, cost)
+
+    def _mmas_deposit(self, graph: Graph, tour: list, cost: float):
+        low, high = self.tau_min, self.tau_max
+        for row in graph.pheromone:
+            row[:] = [min(max(tau * self.rho, low), high) for tau in row]
+        for k in range(1, len(tour)):
+            i, j = tour[k - 1], tour[k]
+            graph.pheromone[i][j] = min(
+                graph.pheromone[i][j] + self.Q / cost, high)
+
+    def _mmas_limits(self, graph: Graph):
+        self.tau_max = self.Q / ((1 - self.rho) * self.best_cost)
+        if graph.rank <= 2:  # a single tour, nothing to keep exploring
+            self.tau_min = self.tau_max
+            return
+        p_dec = self.p_best**(1 / graph.rank)
+        self.tau_min = min(
+            self.tau_max * (1 - p_dec) / ((graph.rank / 2 - 1) * p_dec),
+            self.tau_max)
+
+    def _mmas_stagnant(self, graph: Graph):
+        """
+        True when the colony has converged and stopped improving, after
+        which the pheromone is reset to tau_max.
+        """
+        history = self.round_best_cost
+        if len(history) - self._restarted <= MMAS_RESTART_STAGNATION or \
+                history[-1] < history[-1 - MMAS_RESTART_STAGNATION]:
+            return False
+        if self.branching_factor(graph) > MMAS_RESTART_BRANCHING:
+            return False
+        self._restarted = len(history)
+        return True
+
+    def _update_acs(self, graph: Graph):
+        """
+        Global update of ACS, only the edges of the best-so-far tour.
+        """
+        amount = (1 - self.rho) * self.Q / self.best_cost
+        tour = self.best_solution
+        for k in range(1, len(tour)):
+            i, j = tour[k - 1], tour[k]
+            graph.pheromone[i][j] = self.rho * graph.pheromone[i][j] + amount
+
+    def _local_update(self, graph: Graph, i: int, j: int):
+        """
+        ACS local update of the edge an ant just crossed, making it less
+        attractive to the ants that follow.
+        """
+        tau = (1 - self.xi) * graph.pheromone[i][j] + self.xi * self.tau0
+        graph.pheromone[i][j] = tau
+        eta = graph.heuristic(self.angle_eta_weight)[i][j]
+        graph.choice_info[i][j] = tau**self.alpha * eta**self.beta
+
+    def _nearest_neighbour_cost(self, graph: Graph):
+        """
+        Cost of the greedy nearest neighbour tour from node 0.
+        """
+        current, cost = 0, 0
+        unvisited = set(range(1, graph.rank))
+        while unvisited:
+            row = graph.matrix[current]
+            selected = min(unvisited, key=row.__getitem__)
+            cost += row[selected]
+            unvisited.remove(selected)
+            current = selected
+        return cost + graph.matrix[current][0]
+
+    def _fill_pheromone(self, graph: Graph, value: float):
+        for row in graph.pheromone:
+            row[:] = [value] * graph.rank
+
+    def solve(self, graph: Graph, **limits):
         """
         :param graph:
+        :param limits: early stopping limits, see iter_solve
         """
-        best_cost = float('inf')
-        angle_cost = float('inf')
-        best_solution = []
-        for gen in range(self.generations):
-            round_cost_sum = 0.0
-            round_angle_cost_sum = 0.0
-            # noinspection PyUnusedLocal
-            ants = [_Ant(self, graph) for i in range(self.ant_count)]
-            for ant in ants:
-                for i in range(graph.rank - 1):
-                    ant._select_next()
-                ant.total_cost += graph.matrix[ant.tabu[-1]][ant.tabu[0]]
-                ant.total_angle_cost += graph.angle_matrix[ant.tabu[-1]][
-                    ant.tabu[0]]
-                ant.tabu.append(ant.tabu[0])
-                round_cost_sum += ant.total_cost
-                round_angle_cost_sum += ant.total_angle_cost
-                if ant.total_cost < best_cost:
-                    best_cost = ant.total_cost
-                    angle_cost = ant.total_angle_cost
-                    best_solution = [] + ant.tabu
-                # update pheromone
-                ant._update_pheromone_delta()
-            self.round_costs_mean.append(round_cost_sum / self.ant_count)
-            self.round_angle_costs_mean.append(round_angle_cost_sum /
-                                               self.ant_count)
-            self.round_best_cost.append(best_cost)
-            self.round_angle_cost.append(angle_cost)
-            self._update_pheromone(graph, ants)
-            # print('generation #{}, best cost: {}, path: {}'.format(gen, best_cost, best_solution))
-        return best_solution, best_cost
+        for _ in self.iter_solve(graph, **limits):
+            pass
+        return self.best_solution, self.best_cost
+
+    def iter_solve(self,
+                   graph: Graph,
+                   generations: int = None,
+                   time_budget: float = None,
+                   stagnation_limit: int = None,
+                   target_cost: float = None,
+                   min_branching: float = None,
+                   resume: bool = False):
+        """
+        Anytime variant of solve, yields (generation, best_solution, best_cost)
+        after every generation. The reason of the stop is left in stop_reason.
+        :param generations: generations to run, defaults to self.generations
+        :param time_budget: wall clock seconds, no generation is started that would likely overrun it
+        :param stagnation_limit: stop after this many generations without a better tour
+        :param target_cost: stop as soon as the best cost reaches it
+        :param min_branching: stop when the lambda-branching factor of the pheromone falls to it
+        :param resume: keep the best tour and histories of the previous run
+        """
+        started = time.monotonic()
+        if resume and self.best_solution:
+            self._resume(graph)
+        else:
+            self._start(graph)
+        self.stop_reason = 'generations'
+        stagnant = 0
+        for gen in range(self.generations if generations is None else generations):
+            previous = self.best_cost
+            self._generation(graph)
+            stagnant = 0 if self.best_cost < previous else stagnant + 1
+            yield gen, self.best_solution, self.best_cost
+            reason = self._limit_reached(graph, gen + 1, 1,
+                                         time.monotonic() - started, stagnant,
+                                         time_budget, stagnation_limit,
+                                         target_cost, min_branching)
+            if reason is not None:
+                self.stop_reason = reason
+                break
+
+    def _limit_reached(self, graph: Graph, done: int, step: int,
+                       elapsed: float, stagnant: int, time_budget,
+                       stagnation_limit, target_cost, min_branching):
+        """
+        :param done: generations run so far
+        :param step: generations until the limits are checked again
+        :param stagnant: generations since the best tour last improved
+        :return: the stop reason of iter_solve, None to go on
+        """
+        if target_cost is not None and self.best_cost <= target_cost:
+            return 'target'
+        if stagnation_limit and stagnant >= stagnation_limit:
+            return 'stagnation'
+        if min_branching and self.branching_factor(graph) <= min_branching:
+            return 'branching'
+        if time_budget is not None and \
+                elapsed * (done + step) / done > time_budget:
+            return 'time'
+        return None
+
+    def insert_node(self, graph: Graph, costs, angle_costs):
+        """
+        Add a node to the graph and to the best tour by cheapest insertion.
+        Call iter_solve or solve with resume=True to continue from there.
+        :return: index of the new node
+        """
+        node = graph.add_node(costs, angle_costs)
+        if self.best_solution:
+            tour = self.best_solution
+            k = min(range(1, len(tour)),
+                    key=lambda k: graph.matrix[tour[k - 1]][node] + graph.
+                    matrix[node][tour[k]] - graph.matrix[tour[k - 1]][tour[k]])
+            self._set_best(graph, tour[:k] + [node] + tour[k:])
+        return node
+
+    def remove_node(self, graph: Graph, node: int):
+        """
+        Remove a node from the graph and short-cut it out of the best tour.
+        """
+        graph.remove_node(node)
+        if self.best_solution:
+            tour = [c - (c > node) for c in self.best_solution[:-1] if c != node]
+            self._set_best(graph, tour + tour[:1])
+
+    def update_cost(self, graph: Graph, i: int, j: int, cost: float,
+                    angle_cost=None):
+        """
+        Change an edge cost and re-evaluate the best tour.
+        """
+        graph.update_cost(i, j, cost, angle_cost)
+        if self.best_solution:
+            self._set_best(graph, self.best_solution)
+
+    def _set_best(self, graph: Graph, tour: list):
+        self.best_solution = tour
+        self.best_cost = localsearch.tour_cost(tour, graph.matrix)
+        self.best_angle_cost = localsearch.tour_cost(tour, graph.angle_matrix)
+
+    def branching_factor(self, graph: Graph, lam: float = 0.05):
+        """
+        Mean lambda-branching factor, the number of out edges per node whose
+        pheromone is above min + lam * (max - min). Close to 1 when the colony
+        has converged on a single tour.
+        """
+        total = 0
+        for i, row in enumerate(graph.pheromone):
+            taus = [tau for j, tau in enumerate(row) if j != i]
+            low = min(taus)
+            cut = low + lam * (max(taus) - low)
+            total += sum(1 for tau in taus if tau >= cut)
+        return total / graph.rank
+
+    def _start(self, graph: Graph):
+        self.best_solution = []
+        self.best_cost = float('inf')
+        self.best_angle_cost = float('inf')
+        self.round_costs_mean = []
+        self.round_angle_costs_mean = []
+        self.round_best_cost = []
+        self.round_angle_cost = []
+        self.tau_min = self.tau_max = None
+        self._restarted = 0
+        if self.update_strategy == 6:
+            self.tau0 = 1 / (graph.rank * self._nearest_neighbour_cost(graph))
+            self._fill_pheromone(graph, self.tau0)
+        self._prepare(graph)
+
+    def _resume(self, graph: Graph):
+        if self.update_strategy == 5:
+            self._mmas_limits(graph)
+        elif self.update_strategy == 6 and self.tau0 is None:
+            self.tau0 = 1 / (graph.rank * self._nearest_neighbour_cost(graph))
+        self._prepare(graph)
+
+    def _prepare(self, graph: Graph):
+        require_dense(graph)
+        graph.update_choice_info(self.alpha, self.beta, self.angle_eta_weight)
+
+    # noinspection PyProtectedMember
+    def _generation(self, graph: Graph):
+        round_cost_sum = 0.0
+        round_angle_cost_sum = 0.0
+        # noinspection PyUnusedLocal
+        ants = [_Ant(self, graph) for i in range(self.ant_count)]
+        for ant in ants:
+            for i in range(graph.rank - 1):
+                ant._select_next()
+            ant.total_cost += graph.matrix[ant.tabu[-1]][ant.tabu[0]]
+            ant.total_angle_cost += graph.angle_matrix[ant.tabu[-1]][
+                ant.tabu[0]]
+            ant.tabu.append(ant.tabu[0])
+            if self.local_search == 'ants':
+                ant._local_search()
+        if self.local_search == 'best':
+            min(ants, key=lambda a: a.total_cost)._local_search()
+        for ant in ants:
+            round_cost_sum += ant.total_cost
+            round_angle_cost_sum += ant.total_angle_cost
+            if ant.total_cost < self.best_cost:
+                self.best_cost = ant.total_cost
+                self.best_angle_cost = ant.total_angle_cost
+                self.best_solution = [] + ant.tabu
+            # update pheromone
+            ant._update_pheromone_delta()
+        self.round_costs_mean.append(round_cost_sum / self.ant_count)
+        self.round_angle_costs_mean.append(round_angle_cost_sum /
+                                           self.ant_count)
+        self.round_best_cost.append(self.best_cost)
+        self.round_angle_cost.append(self.best_angle_cost)
+        self._update_pheromone(graph, ants)
+        graph.update_choice_info(self.alpha, self.beta, self.angle_eta_weight)
 
 
 class _Ant(object):
@@ -92,63 +554,46 @@ class _Ant(object):
         self.total_cost = 0.0
         self.total_angle_cost = 0.0
         self.tabu = []  # tabu list
-        self.pheromone_delta = []  # the local increase of pheromone
-        self.allowed = [i for i in range(graph.rank)
-                        ]  # nodes which are allowed for the next selection
-        self.gama = 0.06
-        self.angle_eta_weight = 0.012
-        self.angle_q = 13
-        self.eta = []
-        for i in range(graph.rank):
-            row = []
-            for j in range(graph.rank):
-                if i == j:
-                    row.append(0)
-                    continue
-                v = 1 / graph.matrix[i][j]
-                if self.colony.update_strategy in [3, 4]:
-                    v += self.angle_eta_weight / graph.angle_matrix[i][j]
-                row.append(v)
-            self.eta.append(row)
-        # self.eta = [[
-        #     0 if i == j else
-        #     (1 / graph.matrix[i][j] + 2 / graph.angle_matrix[i][j])
-        #     for j in range(graph.rank)
-        # ] for i in range(graph.rank)]  # heuristic information
+        self.pheromone_delta = [
+        ]  # the local increase of pheromone, as (i, j, amount) edges
+        self.allowed = set(range(
+            graph.rank))  # nodes which are allowed for the next selection
+        self.gama = GAMA
+        self.angle_q = ANGLE_Q
         start = random.randint(0, graph.rank - 1)  # start from any node
         self.tabu.append(start)
         self.current = start
         self.allowed.remove(start)
 
     def _select_next(self):
-        denominator = 0
-        for i in self.allowed:
-            denominator += self.graph.pheromone[
-                self.current][i]**self.colony.alpha * self.eta[
-                    self.current][i]**self.colony.beta
-        # noinspection PyUnusedLocal
-        # probabilities for moving to a node in the next step
-        probabilities = [0 for i in range(self.graph.rank)]
-        for i in range(self.graph.rank):
-            try:
-                self.allowed.index(i)  # test if allowed list contains i
-                probabilities[i] = self.graph.pheromone[self.current][i] ** self.colony.alpha * \
-                    self.eta[self.current][i] ** self.colony.beta / denominator
-            except ValueError:
-                pass  # do nothing
-        # select next node by probability roulette
-        selected = 0
-        rand = random.random()
-        for i, probability in enumerate(probabilities):
-            rand -= probability
-            if rand <= 0:
-                selected = i
-                break
-        # if selected not in self.allowed:
-        #     print(probabilities)
-        #     print(self.graph.pheromone[self.current])
-        #     print(rand, selected)
-        #     raise Exception("unknown")
+        choice_info = self.graph.choice_info[self.current]
+        if self.colony.candidate_count:
+            candidates = [
+                i for i in self.graph.nearest_neighbours(
+                    self.colony.candidate_count)[self.current]
+                if i in self.allowed
+            ]
+        else:
+            candidates = list(self.allowed)
+        if candidates and self.colony.q0 and \
+                random.random() < self.colony.q0:  # greedy move of ACS
+            selected = max(candidates, key=choice_info.__getitem__)
+        elif candidates:
+            denominator = 0
+            for i in candidates:
+                denominator += choice_info[i]
+            # select next node by probability roulette
+            selected = candidates[-1]
+            rand = random.random() * denominator
+            for i in candidates:
+                rand -= choice_info[i]
+                if rand <= 0:
+                    selected = i
+                    break
+        else:  # every candidate is used, fall back to the best remaining node
+            selected = max(self.allowed, key=choice_info.__getitem__)
+        if self.colony.update_strategy == 6:
+            self.colony._local_update(self.graph, self.current, selected)
         self.allowed.remove(selected)
         self.tabu.append(selected)
         self.total_cost += self.graph.matrix[self.current][selected]
@@ -156,23 +601,30 @@ class _Ant(object):
             self.current][selected]
         self.current = selected
 
+    def _local_search(self):
+        neighbours = self.graph.nearest_neighbours(
+            self.colony.candidate_count or localsearch.NEIGHBOUR_COUNT)
+        self.tabu = localsearch.improve(self.tabu, self.graph.matrix,
+                                        neighbours)
+        self.total_cost = localsearch.tour_cost(self.tabu, self.graph.matrix)
+        self.total_angle_cost = localsearch.tour_cost(self.tabu,
+                                                      self.graph.angle_matrix)
+
     # noinspection PyUnusedLocal
     def _update_pheromone_delta(self):
-        self.pheromone_delta = [[0 for j in range(self.graph.rank)]
-                                for i in range(self.graph.rank)]
+        self.pheromone_delta = []
         if self.colony.update_strategy in [0, 1, 2]:
             for _ in range(1, len(self.tabu)):
                 i = self.tabu[_ - 1]
                 j = self.tabu[_]
                 if self.colony.update_strategy == 1:  # ant-quality system
-                    self.pheromone_delta[i][j] = self.colony.Q
+                    amount = self.colony.Q
                 elif self.colony.update_strategy == 2:  # ant-density system
                     # noinspection PyTypeChecker
-                    self.pheromone_delta[i][j] = \
-                        self.colony.Q / self.graph.matrix[i][j]
+                    amount = self.colony.Q / self.graph.matrix[i][j]
                 else:  # ant-cycle system
-                    self.pheromone_delta[i][
-                        j] = self.colony.Q / self.total_cost
+                    amount = self.colony.Q / self.total_cost
+                self.pheromone_delta.append((i, j, amount))
         elif self.colony.update_strategy == 3:
             last = 0
             for _ in range(len(self.tabu) - 1, 0, -1):
@@ -180,26 +632,18 @@ class _Ant(object):
                 j = self.tabu[_]
                 cr = self.colony.Q / self.graph.matrix[i][
                     j] + self.angle_q / self.graph.angle_matrix[i][j]
-                self.pheromone_delta[i][j] = self.gama * last + cr
-                last = self.pheromone_delta[i][j]
+                last = self.gama * last + cr
+                self.pheromone_delta.append((i, j, last))
         elif self.colony.update_strategy == 4:
-
+            expected = self.graph.expected_pheromone()
             for _ in range(len(self.tabu) - 1, 0, -1):
                 i = self.tabu[_ - 1]
                 j = self.tabu[_]
 
                 last = 0
                 if _ != len(self.tabu) - 1:
-                    denominator = 0
-                    for ii in range(self.graph.rank):
-                        denominator += self.graph.pheromone[ii][
-                            i]**self.colony.alpha * self.eta[ii][
-                                i]**self.colony.beta
-                    for ii in range(self.graph.rank):
-                        p = self.graph.pheromone[ii][i] ** self.colony.alpha * \
-                            self.eta[ii][i] ** self.colony.beta / denominator
-                        last += p * self.graph.pheromone[ii][i]
+                    last = expected[i]
 
                 cr = self.colony.Q / self.graph.matrix[i][
                     j] + self.angle_q / self.graph.angle_matrix[i][j]
-                self.pheromone_delta[i][j] = self.gama * last + cr
+                self.pheromone_delta.append((i, j, self.gama * last + cr))
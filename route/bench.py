@@ -0,0 +1,157 @@
+#!/usr/local/bin/python3.8
+"""
+Speed and quality benchmark of the ACO engines.
+
+    python -m uar.route.bench --engine fast --seeds 0 1 2 --output bench.jsonl
+
+Each line of the output is one (engine, dataset, strategy, seed) run, so
+files from two commits can be compared run by run.
+"""
+import argparse
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from uar.route import loader
+from uar.route.aco import ACO, Graph
+from uar.route.fastaco import FastACO
+from uar.route.matrix import angle_matrix, distance_matrix
+
+# optimal tour lengths under exact euclidean distances
+OPTIMA = {
+    'att48': 33523.708,
+    'chn31': 15377.711,
+    'chn144': 30347.0,
+}
+STRATEGIES = [0, 1, 2, 3, 4, 5, 6]
+ENGINES = {'fast': FastACO, 'reference': ACO}
+
+ANT_COUNT = 30
+GENERATIONS = 200
+ALPHA = 1.0
+BETA = 5.0
+RHO = 0.1
+Q = 50
+
+
+def instance(name: str, seed: int):
+    """
+    :param name: a bundled dataset, or 'random<n>' for n uniform random nodes
+    :return: (cost matrix, angle matrix)
+    """
+    rng = np.random.default_rng(seed)
+    if name.startswith('random'):
+        points = rng.uniform(0, 10000, (int(name[len('random'):]), 2))
+        matrix = distance_matrix(points, dtype=float)
+    else:
+        matrix, points = loader.load_matrix(name, dtype=float)
+    return matrix, angle_matrix(len(points), rng, condensed=False)
+
+
+def build(engine: str, matrix, angle, strategy: int, seed: int,
+          generations: int, ant_count: int):
+    """
+    :return: (engine, graph), seeded so that every build runs the same
+    """
+    rank = len(matrix)
+    random.seed(seed)
+    if engine == 'fast':
+        aco = FastACO(ant_count, generations, ALPHA, BETA, RHO, Q, strategy,
+                      seed=seed)
+        graph = Graph(matrix, angle, rank)
+    else:
+        aco = ACO(ant_count, generations, ALPHA, BETA, RHO, Q, strategy)
+        graph = Graph(matrix.tolist(), angle.tolist(), rank)
+    return aco, graph
+
+
+def run(engine: str, name: str, strategy: int, seed: int,
+        generations: int, ant_count: int, memory: bool = True):
+    """
+    :param memory: measure the peak memory in a second, traced run, as tracing
+                   slows the engines down by different factors
+    """
+    matrix, angle = instance(name, seed)
+    rank = len(matrix)
+    args = (engine, matrix, angle, strategy, seed, generations, ant_count)
+
+    aco, graph = build(*args)
+    started = time.perf_counter()
+    _, best = aco.solve(graph)
+    seconds = time.perf_counter() - started
+
+    peak = None
+    if memory:
+        traced, graph = build(*args)
+        tracemalloc.start()
+        traced.solve(graph)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    optimum = OPTIMA.get(name)
+    return dict(engine=engine,
+                dataset=name,
+                rank=rank,
+                strategy=strategy,
+                seed=seed,
+                generations=generations,
+                ant_count=ant_count,
+                seconds=seconds,
+                seconds_per_generation=seconds / generations,
+                ant_steps_per_second=ant_count * rank * generations / seconds,
+                peak_memory_bytes=peak,
+                best_cost=best,
+                final_mean_cost=aco.round_costs_mean[-1],
+                gap=None if optimum is None else best / optimum - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--engine', choices=list(ENGINES), default='fast')
+    parser.add_argument('--datasets',
+                        nargs='+',
+                        default=loader.DATASETS + ['random500'])
+    parser.add_argument('--strategies',
+                        nargs='+',
+                        type=int,
+                        default=STRATEGIES)
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0, 1, 2])
+    parser.add_argument('--generations', type=int, default=GENERATIONS)
+    parser.add_argument('--ants', type=int, default=ANT_COUNT)
+    parser.add_argument('--output', default='bench.jsonl')
+    parser.add_argument('--no-memory',
+                        dest='memory',
+                        action='store_false',
+                        help='skip the traced run that measures peak memory')
+    args = parser.parse_args()
+
+    meta = dict(python=platform.python_version(), numpy=np.__version__)
+    with open(args.output, 'w') as f:
+        for name in args.datasets:
+            for strategy in args.strategies:
+                results = []
+                for seed in args.seeds:
+                    result = run(args.engine, name, strategy, seed,
+                                 args.generations, args.ants, args.memory)
+                    result.update(meta)
+                    f.write(json.dumps(result) + '\n')
+                    f.flush()
+                    results.append(result)
+                costs = [r['best_cost'] for r in results]
+                print('{:>10} strategy {}: {:8.4f} s/gen, best {:.1f}, '
+                      'mean {:.1f}{}'.format(
+                          name, strategy,
+                          np.mean([r['seconds_per_generation']
+                                   for r in results]), min(costs),
+                          np.mean(costs),
+                          '' if results[0]['gap'] is None else
+                          ', gap {:.2%}'.format(min(costs) / OPTIMA[name] -
+                                                1)))
+
+
+if __name__ == '__main__':
+    main()
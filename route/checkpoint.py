@@ -0,0 +1,98 @@
+import json
+
+import numpy as np
+
+from uar.route.aco import ACO, Graph
+
+HISTORIES = [
+    'round_costs_mean', 'round_angle_costs_mean', 'round_best_cost',
+    'round_angle_cost'
+]
+
+
+def save(path: str, aco: ACO, graph: Graph, nodes=None):
+    """
+    Write the pheromone, best tour and histories of a colony to a compressed npz file.
+    :param nodes: ids of the graph nodes, e.g. their coordinates, to warm start
+                  other graphs from this one, defaults to 0 .. rank - 1
+    """
+    if nodes is None:
+        nodes = np.arange(graph.rank)
+    arrays = {h: np.asarray(getattr(aco, h), dtype=float) for h in HISTORIES}
+    rng = getattr(aco, 'rng', None)
+    np.savez_compressed(
+        path,
+        pheromone=np.asarray(graph.pheromone, dtype=float),
+        nodes=np.asarray(nodes),
+        best_solution=np.asarray(aco.best_solution, dtype=np.int64),
+        best_cost=aco.best_cost,
+        best_angle_cost=aco.best_angle_cost,
+        rng_state=json.dumps(rng.bit_generator.state) if rng else '',
+        **arrays)
+
+
+def load(path: str):
+    """
+    :return: dict of the saved arrays
+    """
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+
+def restore(path: str, aco: ACO, graph: Graph):
+    """
+    Put a saved colony back into aco and graph, so that
+    aco.iter_solve(graph, resume=True) continues the run where it stopped.
+    """
+    data = load(path)
+    if len(data['pheromone']) != graph.rank:
+        raise ValueError('checkpoint has {} nodes, graph has {}'.format(
+            len(data['pheromone']), graph.rank))
+    _set_pheromone(graph, data['pheromone'])
+    aco.best_solution = data['best_solution'].tolist()
+    aco.best_cost = float(data['best_cost'])
+    aco.best_angle_cost = float(data['best_angle_cost'])
+    for h in HISTORIES:
+        setattr(aco, h, data[h].tolist())
+    state = str(data['rng_state'])
+    if state and hasattr(aco, 'rng'):
+        aco.rng.bit_generator.state = json.loads(state)
+
+
+def warm_start(path: str, graph: Graph, nodes):
+    """
+    Seed the pheromone of a new graph from a checkpoint of an overlapping one.
+    Edges between nodes known to the checkpoint keep their learned pheromone,
+    edges touching new nodes get the mean learned value.
+    :param nodes: ids of the graph nodes, comparable with the ids saved in the checkpoint
+    :return: number of nodes found in the checkpoint
+    """
+    data = load(path)
+    old_index = {k: i for i, k in enumerate(_keys(data['nodes']))}
+    new, old = [], []
+    for i, k in enumerate(_keys(nodes)):
+        if k in old_index:
+            new.append(i)
+            old.append(old_index[k])
+    pheromone = np.array(graph.pheromone, dtype=float)
+    if len(new) > 1:
+        learned = data['pheromone'][np.ix_(old, old)]
+        off_diagonal = ~np.eye(len(old), dtype=bool)
+        pheromone[:] = learned[off_diagonal].mean()
+        pheromone[np.ix_(new, new)] = learned
+    _set_pheromone(graph, pheromone)
+    return len(new)
+
+
+def _keys(nodes):
+    nodes = np.asarray(nodes)
+    if nodes.ndim == 1:
+        return nodes.tolist()
+    return [tuple(row) for row in nodes.reshape(len(nodes), -1).tolist()]
+
+
+def _set_pheromone(graph: Graph, pheromone: np.ndarray):
+    if isinstance(graph.pheromone, np.ndarray):
+        graph.pheromone = pheromone
+    else:
+        graph.pheromone = pheromone.tolist()
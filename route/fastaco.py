@@ -0,0 +1,241 @@
+import numpy as np
+
+from uar.route import localsearch
+from uar.route.aco import ACO, Graph, GAMA, ANGLE_Q, require_dense
+
+
+def _float_array(matrix):
+    """
+    ndarray of the matrix, keeping float32 storage.
+    """
+    matrix = np.asarray(matrix)
+    if matrix.dtype.kind != 'f':
+        matrix = matrix.astype(float)
+    return matrix
+
+
+class FastACO(ACO):
+    """
+    Array-backed drop-in replacement for `ACO`. Pheromone, heuristic and cost
+    matrices are kept as ndarrays and the tours of all ants are built together,
+    one step at a time, from vectorized probability rows.
+    """
+    def __init__(self,
+                 ant_count: int,
+                 generations: int,
+                 alpha: float,
+                 beta: float,
+                 rho: float,
+                 q: int,
+                 strategy: int,
+                 candidate_count: int = 0,
+                 local_search: str = None,
+                 seed=None):
+        """
+        :param seed: seed of the random generator, same meaning as numpy.random.default_rng
+        """
+        super().__init__(ant_count, generations, alpha, beta, rho, q,
+                         strategy, candidate_count, local_search)
+        self.rng = np.random.default_rng(seed)
+
+    def branching_factor(self, graph: Graph, lam: float = 0.05):
+        tau = np.where(np.eye(graph.rank, dtype=bool), np.nan, graph.pheromone)
+        low = np.nanmin(tau, axis=1, keepdims=True)
+        cut = low + lam * (np.nanmax(tau, axis=1, keepdims=True) - low)
+        return float((tau >= cut).sum() / graph.rank)
+
+    def _prepare(self, graph: Graph):
+        require_dense(graph)
+        graph.matrix = _float_array(graph.matrix)
+        graph.angle_matrix = _float_array(graph.angle_matrix)
+        graph.pheromone = np.asarray(graph.pheromone, dtype=float)
+        self.eta = np.asarray(graph.heuristic(self.angle_eta_weight))
+        self.neighbours = None
+        if self.candidate_count:
+            self.neighbours = self._nearest_neighbours(graph,
+                                                       self.candidate_count)
+        if self.local_search:
+            # plain lists, element access is several times faster in the search
+            self.search_matrix = graph.matrix.tolist()
+            self.search_neighbours = self._nearest_neighbours(
+                graph, self.candidate_count
+                or localsearch.NEIGHBOUR_COUNT).tolist()
+
+    def _nearest_neighbours(self, graph: Graph, k: int):
+        k = min(k, graph.rank - 1)
+        cost = graph.matrix.copy()
+        np.fill_diagonal(cost, np.inf)
+        neighbours = np.argpartition(cost, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(cost, neighbours, axis=1),
+                           axis=1)
+        return np.take_along_axis(neighbours, order, axis=1)
+
+    def _generation(self, graph: Graph):
+        choice = graph.pheromone**self.alpha * self.eta**self.beta
+        tours = self._construct(graph, choice)
+        src, dst = tours[:, :-1], tours[:, 1:]
+        costs = graph.matrix[src, dst].sum(axis=1)
+        if self.local_search:
+            improving = range(self.ant_count) if self.local_search == 'ants' \
+                else [int(np.argmin(costs))]
+            for k in improving:
+                tours[k] = localsearch.improve(tours[k].tolist(),
+                                               self.search_matrix,
+                                               self.search_neighbours)
+            costs = graph.matrix[src, dst].sum(axis=1)
+        angle_costs = graph.angle_matrix[src, dst].sum(axis=1)
+
+        best = int(np.argmin(costs))
+        if costs[best] < self.best_cost:
+            self.best_cost = float(costs[best])
+            self.best_angle_cost = float(angle_costs[best])
+            self.best_solution = tours[best].tolist()
+        self.round_costs_mean.append(float(costs.mean()))
+        self.round_angle_costs_mean.append(float(angle_costs.mean()))
+        self.round_best_cost.append(self.best_cost)
+        self.round_angle_cost.append(self.best_angle_cost)
+
+        if self.update_strategy == 5:
+            self._update_mmas(graph, tours[best], costs[best])
+        elif self.update_strategy == 6:
+            self._update_acs(graph)
+        else:
+            delta = self._pheromone_delta(graph, choice, src, dst, costs)
+            graph.pheromone *= self.rho
+            np.add.at(graph.pheromone, (src.ravel(), dst.ravel()),
+                      delta.ravel())
+
+    def _mmas_deposit(self, graph: Graph, tour, cost: float):
+        tour = np.asarray(tour)
+        graph.pheromone *= self.rho
+        graph.pheromone[tour[:-1], tour[1:]] += self.Q / cost
+        np.clip(graph.pheromone,
+                self.tau_min,
+                self.tau_max,
+                out=graph.pheromone)
+
+    def _update_acs(self, graph: Graph):
+        tour = np.asarray(self.best_solution)
+        edges = tour[:-1], tour[1:]
+        graph.pheromone[edges] = self.rho * graph.pheromone[edges] + \
+            (1 - self.rho) * self.Q / self.best_cost
+
+    def _local_update(self, graph: Graph, choice: np.ndarray, src: np.ndarray,
+                      dst: np.ndarray):
+        """
+        ACS local update of the edges the ants just crossed, in the pheromone
+        and in the choice info of the rest of the construction.
+        """
+        tau = (1 - self.xi) * graph.pheromone[src, dst] + self.xi * self.tau0
+        graph.pheromone[src, dst] = tau
+        choice[src, dst] = tau**self.alpha * self.eta[src, dst]**self.beta
+
+    def _nearest_neighbour_cost(self, graph: Graph):
+        matrix = _float_array(graph.matrix)
+        visited = np.zeros(graph.rank, dtype=bool)
+        current, cost = 0, 0.0
+        for _ in range(graph.rank - 1):
+            visited[current] = True
+            selected = int(np.argmin(np.where(visited, np.inf,
+                                              matrix[current])))
+            cost += matrix[current, selected]
+            current = selected
+        return cost + matrix[current, 0]
+
+    def _construct(self, graph: Graph, choice: np.ndarray):
+        """
+        Build the closed tours of all ants at once.
+        :return: (ant_count, rank + 1) array of node indices
+        """
+        rank = graph.rank
+        ants = np.arange(self.ant_count)
+        tours = np.empty((self.ant_count, rank + 1), dtype=np.intp)
+        visited = np.zeros((self.ant_count, rank), dtype=bool)
+        current = self.rng.integers(0, rank, self.ant_count)
+        tours[:, 0] = current
+        visited[ants, current] = True
+        for step in range(1, rank):
+            previous = current
+            greedy = self.rng.random(self.ant_count) < self.q0 \
+                if self.q0 else None
+            if self.neighbours is None:
+                current = self._roulette(choice[current], visited, greedy)
+            else:
+                current = self._select_candidate(choice, current, visited,
+                                                 greedy)
+            if self.update_strategy == 6:
+                self._local_update(graph, choice, previous, current)
+            tours[:, step] = current
+            visited[ants, current] = True
+        tours[:, rank] = tours[:, 0]
+        return tours
+
+    def _roulette(self, weights: np.ndarray, used: np.ndarray, greedy=None):
+        """
+        Draw one column per row of weights, skipping the used ones.
+        :param greedy: mask of the rows taking their largest weight instead, for ACS
+        """
+        weights[used] = 0
+        cumulative = np.cumsum(weights, axis=1)
+        total = cumulative[:, -1]
+        stuck = total <= 0
+        if stuck.any():  # every remaining weight underflowed
+            cumulative[stuck] = np.cumsum(~used[stuck], axis=1)
+            total = cumulative[:, -1]
+        rand = self.rng.random(len(weights)) * total
+        selected = np.argmax(cumulative > rand[:, None], axis=1)
+        if greedy is not None and greedy.any():
+            selected[greedy] = np.argmax(np.where(used[greedy], -1,
+                                                  weights[greedy]),
+                                         axis=1)
+        return selected
+
+    def _select_candidate(self, choice: np.ndarray, current: np.ndarray,
+                          visited: np.ndarray, greedy=None):
+        """
+        Select among the unvisited nearest neighbours, or the best remaining
+        node for ants whose candidates are all visited.
+        """
+        candidates = self.neighbours[current]
+        used = np.take_along_axis(visited, candidates, axis=1)
+        selected = np.take_along_axis(
+            candidates,
+            self._roulette(choice[current[:, None], candidates], used,
+                           greedy)[:, None],
+            axis=1)[:, 0]
+        exhausted = used.all(axis=1)
+        if exhausted.any():
+            weights = choice[current[exhausted]]
+            weights[visited[exhausted]] = -1
+            selected[exhausted] = np.argmax(weights, axis=1)
+        return selected
+
+    def _pheromone_delta(self, graph: Graph, choice: np.ndarray,
+                         src: np.ndarray, dst: np.ndarray, costs: np.ndarray):
+        """
+        Pheromone deposited by each ant on each edge of its tour.
+        :return: array shaped like src/dst
+        """
+        if self.update_strategy == 1:  # ant-quality system
+            return np.full(src.shape, float(self.Q))
+        if self.update_strategy == 2:  # ant-density system
+            return self.Q / graph.matrix[src, dst]
+        if self.update_strategy == 0:  # ant-cycle system
+            return np.repeat((self.Q / costs)[:, None], src.shape[1], axis=1)
+
+        cr = self.Q / graph.matrix[src, dst] + \
+            ANGLE_Q / graph.angle_matrix[src, dst]
+        if self.update_strategy == 3:
+            delta = np.empty_like(cr)
+            last = np.zeros(len(cr))
+            for k in range(cr.shape[1] - 1, -1, -1):
+                last = GAMA * last + cr[:, k]
+                delta[:, k] = last
+            return delta
+        # r-aco: expected pheromone flowing into the source node of each edge
+        denominator = choice.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected = (choice * graph.pheromone).sum(axis=0) / denominator
+        last = expected[src]
+        last[:, -1] = 0
+        return GAMA * last + cr
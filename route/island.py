@@ -0,0 +1,262 @@
+import os
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from uar.route.aco import ACO, Graph, require_dense
+from uar.route.fastaco import FastACO
+
+_island = {}  # per worker process state, filled by _init_island
+
+
+class IslandACO(ACO):
+    """
+    Island model: several FastACO colonies run in a process pool, each with its
+    own pheromone and random stream, and exchange information every
+    `migration_interval` generations through shared memory.
+    """
+    def __init__(self,
+                 ant_count: int,
+                 generations: int,
+                 alpha: float,
+                 beta: float,
+                 rho: float,
+                 q: int,
+                 strategy: int,
+                 candidate_count: int = 0,
+                 local_search: str = None,
+                 islands: int = None,
+                 migration_interval: int = 10,
+                 migration: str = 'blend',
+                 migration_rate: float = 0.2,
+                 seed=None):
+        """
+        :param ant_count: ants per island
+        :param islands: number of colonies, one process each, defaults to the cpu count
+        :param migration_interval: generations between two exchanges
+        :param migration: 'blend' - mix in the pheromone of the previous island on the ring,
+                          'best' - every island deposits the best tour found by any island
+        :param migration_rate: weight of the received pheromone or tour
+        :param seed: seed of the island random streams
+        """
+        super().__init__(ant_count, generations, alpha, beta, rho, q,
+                         strategy, candidate_count, local_search)
+        if migration not in ['blend', 'best']:
+            raise ValueError('unknown migration: {}'.format(migration))
+        self.islands = islands or os.cpu_count()
+        self.migration_interval = migration_interval
+        self.migration = migration
+        self.migration_rate = migration_rate
+        self.seed = seed
+
+    branching_factor = FastACO.branching_factor
+
+    def iter_solve(self,
+                   graph: Graph,
+                   generations: int = None,
+                   time_budget: float = None,
+                   stagnation_limit: int = None,
+                   target_cost: float = None,
+                   min_branching: float = None,
+                   resume: bool = False):
+        """
+        ACO.iter_solve over the islands. The colonies only meet at the
+        migrations, so the best tour of all islands is yielded and the limits
+        are checked every migration_interval generations, and once more at
+        the end. The branching factor is the one of the island holding the
+        best tour. With resume, the colonies go on from graph.pheromone and
+        the best tour so far, as ACO.iter_solve does.
+        """
+        require_dense(graph)
+        started = time.monotonic()
+        generations = self.generations if generations is None else generations
+        resume = bool(resume and self.best_solution)
+        if not resume:
+            self._start(graph)
+        self.stop_reason = 'generations'
+        rank = graph.rank
+        pheromone = np.asarray(graph.pheromone, dtype=float)
+        blocks = [
+            _SharedArray(np.asarray(graph.matrix, dtype=float)),
+            _SharedArray(np.asarray(graph.angle_matrix, dtype=float)),
+            _SharedArray(np.broadcast_to(pheromone,
+                                         (self.islands, rank, rank))),
+            _SharedArray(np.zeros((self.islands, rank + 1), dtype=np.intp)),
+            _SharedArray(np.full(self.islands, np.inf)),
+            _SharedArray(np.zeros(1, dtype=np.intp)),  # 1 stops the islands
+        ]
+        matrix, angle_matrix, pheromones, tours, costs, stop = [
+            b.array for b in blocks
+        ]
+        seeds = np.random.SeedSequence(self.seed).spawn(self.islands)
+        ctx = mp.get_context()
+        # the islands and this process meet at every migration
+        barrier = ctx.Barrier(self.islands + 1)
+        results = None
+        try:
+            with ctx.Pool(self.islands,
+                          initializer=_init_island,
+                          initargs=(self, [b.spec for b in blocks], seeds,
+                                    barrier, generations, resume)) as pool:
+                pending = pool.map_async(_run_island, range(self.islands))
+                try:
+                    # graph of the best island, for the branching factor
+                    view = Graph(matrix, angle_matrix, rank)
+                    stagnant = 0
+                    for gen in range(self.migration_interval, generations,
+                                     self.migration_interval):
+                        barrier.wait()  # tours and costs written
+                        best = int(np.argmin(costs))
+                        improved = costs[best] < self.best_cost
+                        if improved:
+                            self._take_best(angle_matrix, tours[best],
+                                            costs[best])
+                        stagnant = 0 if improved else \
+                            stagnant + self.migration_interval
+                        yield gen - 1, self.best_solution, self.best_cost
+                        view.pheromone = pheromones[best]
+                        reason = self._limit_reached(
+                            view, gen, self.migration_interval,
+                            time.monotonic() - started, stagnant, time_budget,
+                            stagnation_limit, target_cost, min_branching)
+                        if reason is not None:
+                            self.stop_reason = reason
+                            stop[0] = 1
+                        barrier.wait()  # the islands read stop
+                        if reason is not None:
+                            break
+                        barrier.wait()  # the islands read each other
+                    results = pending.get()
+                finally:
+                    if results is None:  # stopped by the caller or failed
+                        barrier.abort()
+            winner = int(np.argmin([r['best_cost'] for r in results]))
+            graph.pheromone = pheromones[winner].copy()
+        finally:
+            for b in blocks:
+                b.release()
+
+        if results[winner]['best_cost'] < self.best_cost:
+            self.best_solution = results[winner]['best_solution']
+            self.best_cost = results[winner]['best_cost']
+            self.best_angle_cost = results[winner]['best_angle_cost']
+        for gen in range(len(results[winner]['round_best_cost'])):
+            best = min(results, key=lambda r: r['round_best_cost'][gen])
+            self.round_costs_mean.append(
+                float(np.mean([r['round_costs_mean'][gen] for r in results])))
+            self.round_angle_costs_mean.append(
+                float(
+                    np.mean([r['round_angle_costs_mean'][gen]
+                             for r in results])))
+            self.round_best_cost.append(best['round_best_cost'][gen])
+            self.round_angle_cost.append(best['round_angle_cost'][gen])
+        if self.stop_reason == 'generations':
+            yield generations - 1, self.best_solution, self.best_cost
+
+    def _take_best(self, angle_matrix: np.ndarray, tour: np.ndarray,
+                   cost: float):
+        self.best_solution = tour.tolist()
+        self.best_cost = float(cost)
+        self.best_angle_cost = float(angle_matrix[tour[:-1], tour[1:]].sum())
+
+
+class _SharedArray(object):
+    """
+    ndarray placed in a shared memory block, attached by name in the workers.
+    """
+    def __init__(self, array=None, spec=None):
+        if spec is None:
+            self.shm = shared_memory.SharedMemory(create=True,
+                                                  size=max(array.nbytes, 1))
+            self.spec = (self.shm.name, array.shape, array.dtype.str)
+        else:
+            self.shm = shared_memory.SharedMemory(name=spec[0])
+            self.spec = spec
+        self.array = np.ndarray(self.spec[1],
+                                dtype=self.spec[2],
+                                buffer=self.shm.buf)
+        if array is not None:
+            self.array[...] = array
+
+    def release(self):
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _init_island(colony: IslandACO, specs: list, seeds: list, barrier,
+                 generations: int, resume: bool):
+    _island['colony'] = colony
+    _island['blocks'] = [_SharedArray(spec=spec) for spec in specs]
+    _island['seeds'] = seeds
+    _island['barrier'] = barrier
+    _island['generations'] = generations
+    _island['resume'] = resume
+
+
+# noinspection PyProtectedMember
+def _run_island(index: int):
+    colony = _island['colony']
+    barrier = _island['barrier']
+    generations = _island['generations']
+    matrix, angle_matrix, pheromones, tours, costs, stop = [
+        b.array for b in _island['blocks']
+    ]
+    aco = FastACO(colony.ant_count,
+                  generations,
+                  colony.alpha,
+                  colony.beta,
+                  colony.rho,
+                  colony.Q,
+                  colony.update_strategy,
+                  colony.candidate_count,
+                  colony.local_search,
+                  seed=_island['seeds'][index])
+    aco.p_best, aco.q0, aco.xi = colony.p_best, colony.q0, colony.xi
+    graph = Graph(matrix, angle_matrix, len(matrix))
+    graph.pheromone = pheromones[index]
+    if _island['resume']:
+        # the colony pickled with the best tour and tau0 of the main process
+        aco.best_solution = list(colony.best_solution)
+        aco.best_cost = colony.best_cost
+        aco.best_angle_cost = colony.best_angle_cost
+        aco.tau0 = colony.tau0
+        aco._resume(graph)
+    else:
+        aco._start(graph)
+    for gen in range(1, generations + 1):
+        aco._generation(graph)
+        if gen % colony.migration_interval or gen == generations:
+            continue
+        tours[index] = aco.best_solution
+        costs[index] = aco.best_cost
+        barrier.wait()
+        barrier.wait()  # the main process checks its limits in between
+        if stop[0]:
+            break
+        if colony.migration == 'blend':
+            received = pheromones[(index - 1) % len(costs)]
+            blended = (1 - colony.migration_rate) * graph.pheromone + \
+                colony.migration_rate * received
+        else:
+            best = int(np.argmin(costs))
+            tour = tours[best].copy()
+            blended = graph.pheromone.copy()
+            np.add.at(blended, (tour[:-1], tour[1:]),
+                      colony.migration_rate * colony.Q / costs[best])
+            if costs[best] < aco.best_cost:
+                aco.best_cost = float(costs[best])
+                aco.best_angle_cost = float(
+                    graph.angle_matrix[tour[:-1], tour[1:]].sum())
+                aco.best_solution = tour.tolist()
+        barrier.wait()
+        graph.pheromone[...] = blended
+    return dict(best_solution=aco.best_solution,
+                best_cost=aco.best_cost,
+                best_angle_cost=aco.best_angle_cost,
+                round_costs_mean=aco.round_costs_mean,
+                round_angle_costs_mean=aco.round_angle_costs_mean,
+                round_best_cost=aco.round_best_cost,
+                round_angle_cost=aco.round_angle_cost)
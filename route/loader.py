@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+
+from uar.route.matrix import CondensedMatrix, LazyDistanceMatrix, distance_matrix
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+DATASETS = ['att48', 'chn31', 'chn144']
+
+_TSPLIB_METRICS = {
+    'EUC_2D': 'euc_2d',
+    'CEIL_2D': 'ceil_2d',
+    'ATT': 'att',
+    'GEO': 'geo',
+}
+
+
+def dataset_path(name: str):
+    """
+    :param name: one of DATASETS
+    """
+    if name not in DATASETS:
+        raise ValueError('unknown dataset: {}'.format(name))
+    return os.path.join(DATA_DIR, name + '.txt')
+
+
+def load_points(path: str):
+    """
+    Read node coordinates from a bundled `index x y` file or a TSPLIB file
+    with a NODE_COORD_SECTION.
+    :param path: file path, or the name of a bundled dataset
+    :return: (points, metric) - (n, 2) float array and the distance metric of the file
+    """
+    if path in DATASETS:
+        path = dataset_path(path)
+    metric = 'euclidean'
+    rows = []
+    with open(path) as f:
+        lines = iter(f)
+        for line in lines:
+            line = line.strip()
+            if not line or line == 'EOF':
+                continue
+            if line.startswith('NODE_COORD_SECTION'):
+                continue
+            if ':' in line:  # TSPLIB specification line
+                key, value = [s.strip() for s in line.split(':', 1)]
+                if key == 'EDGE_WEIGHT_TYPE':
+                    if value not in _TSPLIB_METRICS:
+                        raise ValueError(
+                            'unsupported EDGE_WEIGHT_TYPE: {}'.format(value))
+                    metric = _TSPLIB_METRICS[value]
+                continue
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            rows.append((float(fields[1]), float(fields[2])))
+    return np.array(rows, dtype=float).reshape(-1, 2), metric
+
+
+def load_matrix(path: str,
+                representation='dense',
+                dtype=np.float32,
+                cache_rows=1024):
+    """
+    Load a coordinate file as a cost matrix.
+    :param representation: 'dense' - ndarray, what the solvers take,
+                           'condensed' - upper triangle only,
+                           'lazy' - rows computed on demand, `cache_rows` kept;
+                           the last two for storing and looking up costs
+    :return: (matrix, points)
+    """
+    points, metric = load_points(path)
+    if representation == 'dense':
+        matrix = distance_matrix(points, metric, dtype)
+    elif representation == 'condensed':
+        matrix = CondensedMatrix.from_points(points, metric, dtype)
+    elif representation == 'lazy':
+        matrix = LazyDistanceMatrix(points, metric, dtype, cache_rows)
+    else:
+        raise ValueError(
+            'unknown representation: {}'.format(representation))
+    return matrix, points
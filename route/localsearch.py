@@ -0,0 +1,177 @@
+from collections import deque
+
+NEIGHBOUR_COUNT = 10  # neighbour list length used when the colony has none
+EPSILON = 1e-9
+
+
+def tour_cost(tour: list, matrix) -> float:
+    """
+    :param tour: closed tour, first node repeated at the end
+    """
+    cost = 0.0
+    for _ in range(1, len(tour)):
+        cost += matrix[tour[_ - 1]][tour[_]]
+    return cost
+
+
+class _Tour(object):
+    """
+    Cyclic node order with positions, for in place 2-opt and Or-opt moves.
+    """
+    def __init__(self, tour: list):
+        self.order = [int(c) for c in tour[:-1]]
+        self.n = len(self.order)
+        self.pos = [0] * self.n
+        self._index()
+
+    def _index(self):
+        for k, c in enumerate(self.order):
+            self.pos[c] = k
+
+    def succ(self, c):
+        return self.order[(self.pos[c] + 1) % self.n]
+
+    def pred(self, c):
+        return self.order[(self.pos[c] - 1) % self.n]
+
+    def reverse(self, i: int, j: int):
+        """
+        Reverse the path from position i forward to position j, or the
+        complementary path when it is shorter, which gives the same cycle.
+        """
+        inner = (j - i) % self.n + 1
+        if 2 * inner > self.n:
+            i, j = (j + 1) % self.n, (i - 1) % self.n
+            inner = self.n - inner
+        for _ in range(inner // 2):
+            ci, cj = self.order[i], self.order[j]
+            self.order[i], self.order[j] = cj, ci
+            self.pos[cj], self.pos[ci] = i, j
+            i = (i + 1) % self.n
+            j = (j - 1) % self.n
+
+    def move(self, segment: list, after: int, reverse: bool = False):
+        """
+        Cut a forward path out of the cycle and insert it after node `after`.
+        """
+        start = self.pos[segment[0]]
+        rest = [
+            self.order[(start + len(segment) + k) % self.n]
+            for k in range(self.n - len(segment))
+        ]
+        k = rest.index(after) + 1
+        self.order = rest[:k] + (segment[::-1]
+                                 if reverse else segment) + rest[k:]
+        self._index()
+
+    def closed(self, start: int):
+        k = self.pos[start]
+        return self.order[k:] + self.order[:k] + [start]
+
+
+def two_opt(tour: list, matrix, neighbours) -> list:
+    """
+    2-opt driven by neighbour lists and don't-look bits, for symmetric costs.
+    :param tour: closed tour, first node repeated at the end
+    :param neighbours: candidate successors of each node, nearest first
+    :return: improved closed tour, starting from the same node
+    """
+    t = _Tour(tour)
+    queue = deque(t.order)
+    queued = [True] * t.n
+    while queue:
+        a = queue.popleft()
+        queued[a] = False
+        for forward in [True, False]:
+            b = t.succ(a) if forward else t.pred(a)
+            d_ab = matrix[a][b]
+            for c in neighbours[a]:
+                d_ac = matrix[a][c]
+                if d_ac >= d_ab:
+                    break
+                d = t.succ(c) if forward else t.pred(c)
+                if c == b or d == a:
+                    continue
+                if d_ac + matrix[b][d] - d_ab - matrix[c][d] < -EPSILON:
+                    if forward:
+                        t.reverse(t.pos[b], t.pos[c])
+                    else:
+                        t.reverse(t.pos[a], t.pos[d])
+                    for x in [a, b, c, d]:
+                        if not queued[x]:
+                            queued[x] = True
+                            queue.append(x)
+                    break
+            else:
+                continue
+            break
+    return t.closed(tour[0])
+
+
+def or_opt(tour: list, matrix, neighbours, max_segment: int = 3) -> list:
+    """
+    Or-opt, moving paths of up to max_segment nodes (possibly reversed) next
+    to one of the neighbours of their end nodes, with don't-look bits.
+    :return: improved closed tour, starting from the same node
+    """
+    t = _Tour(tour)
+    queue = deque(t.order)
+    queued = [True] * t.n
+    while queue:
+        a = queue.popleft()
+        queued[a] = False
+        touched = _or_move(t, a, matrix, neighbours,
+                           min(max_segment, t.n - 3))
+        for x in touched:
+            if not queued[x]:
+                queued[x] = True
+                queue.append(x)
+    return t.closed(tour[0])
+
+
+def _or_move(t: _Tour, a: int, matrix, neighbours, max_segment: int):
+    """
+    Apply the first improving move of a path starting at a.
+    :return: nodes whose neighbourhood changed, empty when nothing moved
+    """
+    segment = [a]
+    for _ in range(max_segment):
+        if _:
+            segment.append(t.succ(segment[-1]))
+        e = segment[-1]
+        p, nx = t.pred(a), t.succ(e)
+        gain = matrix[p][a] + matrix[e][nx] - matrix[p][nx]
+        if gain <= EPSILON:
+            continue
+        for end, other in [(a, e), (e, a)]:
+            for c in neighbours[end]:
+                d_c = matrix[end][c]
+                if d_c >= gain:
+                    break
+                if c in segment:
+                    continue
+                # end next to c, either after c or before it
+                for after, d in [(True, t.succ(c)), (False, t.pred(c))]:
+                    if d in segment:
+                        continue
+                    added = d_c + matrix[other][d] - matrix[c][d]
+                    if added - gain < -EPSILON:
+                        if after:  # c, end .. other, d
+                            t.move(segment, c, end != a)
+                        else:  # d, other .. end, c
+                            t.move(segment, d, end == a)
+                        return [p, nx, c, d] + segment
+    return []
+
+
+def improve(tour: list, matrix, neighbours, rounds: int = 5) -> list:
+    """
+    Alternate 2-opt and Or-opt until neither improves the tour.
+    """
+    for _ in range(rounds):
+        tour = two_opt(tour, matrix, neighbours)
+        moved = or_opt(tour, matrix, neighbours)
+        if moved == tour:
+            break
+        tour = moved
+    return tour
@@ -1,7 +1,9 @@
-import random
 import math
+import random
 
+from uar.db.cache import cache_key, cached
 from uar.landform import generator
+from uar.route import loader, matrix, obstacle
 from uar.route.aco import ACO, Graph
 from uar.route.plot import plot
 
@@ -60,41 +62,63 @@ RHO = 0.1
 Q = 50
 
 
-def run(cost_matrix: list, cost_angle_matrix: list, method: int):
-    aco = ACO(ANT_COUNT, GENERATIONS, ALPHA, BETA, RHO, Q, method)
-    graph = Graph(cost_matrix, cost_angle_matrix, len(cost_matrix[0]))
-    path, cost = aco.solve(graph)
-    print('cost: {}, path: {}'.format(cost, path))
+def run(cost_matrix,
+        cost_angle_matrix,
+        method: int,
+        seed=0,
+        cache=None):
+    """
+    :param seed: seed of the ants, a run with the same inputs and seed is read from the cache
+    :param cache: see uar.db.cache.cached, None to always solve
+    """
+    def solve():
+        random.seed(seed)
+        aco = ACO(ANT_COUNT, GENERATIONS, ALPHA, BETA, RHO, Q, method)
+        aco.solve(Graph(cost_matrix, cost_angle_matrix, len(cost_matrix)))
+        return aco
+
+    key = cache_key('aco', cost_matrix, cost_angle_matrix, method, seed,
+                    ANT_COUNT, GENERATIONS, ALPHA, BETA, RHO, Q)
+    aco = cached(cache, key, solve)
+    print('cost: {}, path: {}'.format(aco.best_cost, aco.best_solution))
     #plot(points, path)
     return aco
 
 
-def main():
-    # points = []
-    # cities = []
-    # with open('/Users/djy/Developer/go/dep/ml/uar/route/data/chn31.txt') as f:
-    #     for line in f.readlines():
-    #         city = line.split(' ')
-    #         cities.append(
-    #             dict(index=int(city[0]), x=int(city[1]), y=int(city[2])))
-    #         points.append((int(city[1]), int(city[2])))
-    land = generator.LandForm(100, 100)
-    rank = len(land.cities)
-    cost_matrix = []
-    cost_angle_matrix = [[0 for j in range(rank)] for i in range(rank)]
-    for i in range(rank):
-        row = []
-        for j in range(rank):
-            row.append(distance(land.cities[i], land.cities[j]))
-            cost_angle_matrix[i][j] = cost_angle_matrix[j][i]
-            if cost_angle_matrix[i][j] == 0:
-                cost_angle_matrix[i][j] = random.randint(1, 100)
-        cost_matrix.append(row)
+def main(dataset: str = None,
+         seed=0,
+         cache=None,
+         obstacles=True,
+         processes: int = None,
+         cache_dir: str = obstacle.CACHE_DIR):
+    """
+    :param dataset: name or path of a coordinate file, a random LandForm when None
+    :param seed: seed of the landform, the angles and the ants
+    :param cache: passed to run, e.g. uar.db.cache.DiskCache()
+    :param obstacles: LandForm costs go around the obstacles, else straight
+                      distances from matrix.landform_matrices
+    :param processes: pool size of obstacle.obstacle_matrix
+    :param cache_dir: where obstacle.obstacle_matrix keeps its matrices, None to skip
+    """
+    if dataset is not None:
+        cost_matrix, cities = loader.load_matrix(dataset)
+        cost_angle_matrix = matrix.angle_matrix(len(cities), seed)
+    elif obstacles:
+        land = generator.LandForm(100, 100, seed=seed)
+        cost_matrix = obstacle.obstacle_matrix(land.map, land.cities,
+                                               processes, cache_dir)
+        keep = obstacle.reachable(cost_matrix)
+        cost_matrix = cost_matrix[keep[:, None], keep]
+        cost_angle_matrix = matrix.angle_matrix(len(keep), seed)
+    else:
+        land = generator.LandForm(100, 100, seed=seed)
+        cost_matrix, cost_angle_matrix = matrix.landform_matrices(
+            land.cities, seed)
     plot_round_bests({
-        "ACO": run(cost_matrix, cost_angle_matrix, 2),
+        "ACO": run(cost_matrix, cost_angle_matrix, 2, seed, cache),
         # "f-ant-density":
-        # run(cost_matrix, cost_angle_matrix, 3),
-        "R-ACO": run(cost_matrix, cost_angle_matrix, 4),
+        # run(cost_matrix, cost_angle_matrix, 3, seed, cache),
+        "R-ACO": run(cost_matrix, cost_angle_matrix, 4, seed, cache),
     })
 
 
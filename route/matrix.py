@@ -0,0 +1,241 @@
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+METRICS = ['euclidean', 'euc_2d', 'ceil_2d', 'att', 'geo']
+BLOCK_ROWS = 512  # rows computed together when a full matrix is built
+
+
+def pair_distances(a: np.ndarray, b: np.ndarray, metric='euclidean'):
+    """
+    Distances between coordinate arrays of broadcastable shapes (..., 2).
+    :param metric: 'euclidean' - exact, as in route/main.py;
+                   'euc_2d', 'ceil_2d', 'att', 'geo' - TSPLIB edge weight types
+    """
+    if metric == 'geo':
+        return _geo_distances(a, b)
+    squared = ((a - b)**2).sum(axis=-1)
+    if metric == 'att':
+        r = np.sqrt(squared / 10)
+        t = np.rint(r)
+        return np.where(t < r, t + 1, t)
+    d = np.sqrt(squared)
+    if metric == 'euc_2d':
+        return np.floor(d + 0.5)
+    if metric == 'ceil_2d':
+        return np.ceil(d)
+    if metric == 'euclidean':
+        return d
+    raise ValueError('unknown metric: {}'.format(metric))
+
+
+def _geo_distances(a: np.ndarray, b: np.ndarray):
+    def radians(x):
+        degrees = np.trunc(x)
+        return math.pi * (degrees + 5 * (x - degrees) / 3) / 180
+
+    lat_a, lon_a = radians(a[..., 0]), radians(a[..., 1])
+    lat_b, lon_b = radians(b[..., 0]), radians(b[..., 1])
+    q1 = np.cos(lon_a - lon_b)
+    q2 = np.cos(lat_a - lat_b)
+    q3 = np.cos(lat_a + lat_b)
+    cos = np.clip(0.5 * ((1 + q1) * q2 - (1 - q1) * q3), -1, 1)
+    return np.trunc(6378.388 * np.arccos(cos) + 1)
+
+
+def distance_matrix(points, metric='euclidean', dtype=np.float32):
+    """
+    Dense pairwise distance matrix, built block by block.
+    """
+    points = np.asarray(points, dtype=float)
+    rank = len(points)
+    matrix = np.empty((rank, rank), dtype=dtype)
+    for start in range(0, rank, BLOCK_ROWS):
+        block = points[start:start + BLOCK_ROWS, None]
+        matrix[start:start + BLOCK_ROWS] = pair_distances(
+            block, points[None], metric)
+    np.fill_diagonal(matrix, 0)
+    return matrix
+
+
+def angle_matrix(rank: int, seed=None, condensed=False):
+    """
+    Random symmetric angle costs in [1, 100], drawn in one seeded pass.
+    :param condensed: CondensedMatrix of uint8, for storage only as Graph needs
+                      dense matrices, else a dense float32 ndarray
+    """
+    values = np.random.default_rng(seed).integers(1,
+                                                  101,
+                                                  rank * (rank - 1) // 2,
+                                                  dtype=np.uint8)
+    matrix = CondensedMatrix(values, rank)
+    return matrix if condensed else np.asarray(matrix, dtype=np.float32)
+
+
+def landform_matrices(cities, seed=None, condensed=False):
+    """
+    Distance and angle matrices of LandForm cities, without going through lists.
+    :param cities: LandForm.cities or an (n, 2) array
+    :param condensed: upper triangles only, for storage, else dense float32
+                      ndarrays that Graph takes
+    :return: (cost matrix, angle matrix)
+    """
+    if condensed:
+        cost = CondensedMatrix.from_points(cities)
+    else:
+        cost = distance_matrix(cities)
+    return cost, angle_matrix(len(cost), seed, condensed)
+
+
+class _Row(object):
+    """
+    Row view of a matrix stored in another form, so `matrix[i][j]` still works.
+    """
+    def __init__(self, matrix, i: int):
+        self.matrix = matrix
+        self.i = i
+
+    def __getitem__(self, j):
+        return self.matrix[self.i, j]
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def __iter__(self):
+        return iter(self.matrix.row(self.i).tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        row = self.matrix.row(self.i)
+        return row if dtype is None else row.astype(dtype)
+
+
+class CondensedMatrix(object):
+    """
+    Symmetric matrix with a zero diagonal, storing only the upper triangle.
+    Supports matrix[i][j], matrix[i, j] and numpy.asarray(matrix).
+    """
+    def __init__(self, values: np.ndarray, rank: int):
+        """
+        :param values: upper triangle, row by row, rank * (rank - 1) / 2 items
+        """
+        if len(values) != rank * (rank - 1) // 2:
+            raise ValueError('{} values do not fill a triangle of rank {}'.format(
+                len(values), rank))
+        self.values = values
+        self.rank = rank
+
+    @classmethod
+    def from_points(cls, points, metric='euclidean', dtype=np.float32):
+        points = np.asarray(points, dtype=float)
+        rank = len(points)
+        values = np.empty(rank * (rank - 1) // 2, dtype=dtype)
+        for i in range(rank - 1):
+            offset = cls._offset(i, rank)
+            values[offset:offset + rank - i - 1] = pair_distances(
+                points[i], points[i + 1:], metric)
+        return cls(values, rank)
+
+    @classmethod
+    def from_dense(cls, matrix, dtype=np.float32):
+        matrix = np.asarray(matrix)
+        return cls(matrix[np.triu_indices(len(matrix), 1)].astype(dtype),
+                   len(matrix))
+
+    @staticmethod
+    def _offset(i, rank):
+        return i * rank - i * (i + 1) // 2
+
+    def _index(self, i, j):
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        return self._offset(i, self.rank) + j - i - 1
+
+    def __len__(self):
+        return self.rank
+
+    @property
+    def shape(self):
+        return self.rank, self.rank
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            return _Row(self, key)
+        i, j = key
+        if np.ndim(i) == 0 and np.ndim(j) == 0:
+            if i == j:
+                return 0
+            if i > j:
+                i, j = j, i
+            return self.values[self._offset(i, self.rank) + j - i - 1]
+        i, j = np.broadcast_arrays(i, j)
+        off_diagonal = i != j
+        result = np.zeros(i.shape, dtype=self.values.dtype)
+        result[off_diagonal] = self.values[self._index(
+            i[off_diagonal], j[off_diagonal])]
+        return result
+
+    def row(self, i: int):
+        return self[i, np.arange(self.rank)]
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = np.zeros((self.rank, self.rank),
+                          dtype=dtype or self.values.dtype)
+        upper = np.triu_indices(self.rank, 1)
+        matrix[upper] = self.values
+        matrix.T[upper] = self.values
+        return matrix
+
+
+class LazyDistanceMatrix(object):
+    """
+    Distance matrix computed on demand from the coordinates, keeping the most
+    recently used rows. For instances whose full matrix does not fit in memory.
+    """
+    def __init__(self,
+                 points,
+                 metric='euclidean',
+                 dtype=np.float32,
+                 cache_rows=1024):
+        self.points = np.asarray(points, dtype=float)
+        self.metric = metric
+        self.dtype = np.dtype(dtype)
+        self.rank = len(self.points)
+        self.cache_rows = cache_rows
+        self._rows = OrderedDict()
+
+    def __len__(self):
+        return self.rank
+
+    @property
+    def shape(self):
+        return self.rank, self.rank
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            return self.row(key)
+        i, j = key
+        if np.ndim(i) == 0 and i in self._rows:
+            return self._rows[i][j]
+        return pair_distances(self.points[i], self.points[j],
+                              self.metric).astype(self.dtype)
+
+    def row(self, i: int):
+        i = int(i)
+        if i in self._rows:
+            self._rows.move_to_end(i)
+            return self._rows[i]
+        row = pair_distances(self.points[i], self.points,
+                             self.metric).astype(self.dtype)
+        row[i] = 0
+        self._rows[i] = row
+        if len(self._rows) > self.cache_rows:
+            self._rows.popitem(last=False)
+        return row
+
+    def __array__(self, dtype=None, copy=None):
+        return distance_matrix(self.points, self.metric, dtype
+                               or self.dtype)
@@ -0,0 +1,125 @@
+import hashlib
+import math
+import multiprocessing as mp
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from uar.db.cache import code_version
+from uar.landform.generator import OBSTACLE
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'uar')
+DIAGONAL = math.sqrt(2)
+BATCH_BYTES = 1 << 28  # distance rows one search batch may hold
+
+_search = {}  # per worker process state, filled by _init_search
+
+
+def obstacle_matrix(land_map,
+                    cities,
+                    processes: int = None,
+                    cache_dir: str = CACHE_DIR):
+    """
+    Shortest path costs between cities on the grid, moving to the 8 neighbours
+    of a cell without entering or cutting the corner of an obstacle cell.
+    One scipy Dijkstra search per city over the grid_graph, in batches of
+    sources spread over a process pool.
+    :param land_map: LandForm.map, cells equal to OBSTACLE are blocked
+    :param cities: LandForm.cities or an (n, 2) array
+    :param processes: pool size, defaults to the cpu count, 1 to search in this process
+    :param cache_dir: the matrix is kept there as npz, keyed by a hash of the map, cities and code; None to skip
+    :return: symmetric (n, n) float ndarray, inf between cities that cannot reach each other
+    """
+    blocked = np.asarray(land_map) == OBSTACLE
+    cities = np.asarray(cities, dtype=np.intp).reshape(-1, 2)
+    path = None
+    if cache_dir is not None:
+        key = hashlib.sha1(code_version().encode())  # the search rules too
+        for a in (np.array(blocked.shape), np.packbits(blocked), cities):
+            key.update(np.ascontiguousarray(a).tobytes())
+        path = os.path.join(cache_dir,
+                            'obstacle-{}.npz'.format(key.hexdigest()))
+        if os.path.exists(path):
+            with np.load(path) as data:
+                return data['matrix']
+
+    # sources searched together, at least one batch per process and no more
+    # than BATCH_BYTES of distance rows to every cell in a batch
+    sources = np.arange(max(len(cities) - 1, 0))
+    parts = max(-(-len(sources) * blocked.size * 8 // BATCH_BYTES),
+                processes or os.cpu_count())
+    batches = np.array_split(sources, max(min(parts, len(sources)), 1))
+    args = (blocked, cities)
+    if processes == 1:
+        _init_search(*args)
+        rows = [row for b in batches for row in _search_rows(b)]
+    else:
+        with mp.get_context().Pool(processes,
+                                   initializer=_init_search,
+                                   initargs=args) as pool:
+            rows = [row for part in pool.map(_search_rows, batches)
+                    for row in part]
+    matrix = np.zeros((len(cities), len(cities)))
+    for i, row in enumerate(rows):
+        matrix[i, i + 1:] = row
+        matrix[i + 1:, i] = row
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez_compressed(path, matrix=matrix)
+    return matrix
+
+
+def reachable(matrix: np.ndarray):
+    """
+    :return: indices of the largest group of cities that can all reach each other
+    """
+    finite = np.isfinite(matrix)
+    return np.flatnonzero(finite[np.argmax(finite.sum(axis=1))])
+
+
+def grid_graph(blocked: np.ndarray):
+    """
+    Sparse graph of the grid cells, with an edge to each of the 8 neighbours
+    that is not blocked, diagonals only when both cells beside them are open.
+    :return: csr_matrix over the cells in row-major order
+    """
+    length, width = blocked.shape
+    free = ~blocked
+    ids = np.arange(blocked.size).reshape(blocked.shape)
+    sources, targets, weights = [], [], []
+    for di, dj in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1),
+                   (1, -1), (1, 1)]:
+        # cells whose neighbour (di, dj) is on the grid, and those neighbours
+        rows = slice(max(-di, 0), length - max(di, 0))
+        cols = slice(max(-dj, 0), width - max(dj, 0))
+        next_rows = slice(max(di, 0), length + min(di, 0))
+        next_cols = slice(max(dj, 0), width + min(dj, 0))
+        move = free[next_rows, next_cols]
+        if di and dj:  # no corner cutting
+            move = move & free[next_rows, cols] & free[rows, next_cols]
+        sources.append(ids[rows, cols][move])
+        targets.append(ids[next_rows, next_cols][move])
+        weights.append(np.full(move.sum(), DIAGONAL if di and dj else 1.0))
+    return csr_matrix(
+        (np.concatenate(weights),
+         (np.concatenate(sources), np.concatenate(targets))),
+        shape=(blocked.size, blocked.size))
+
+
+def _init_search(blocked: np.ndarray, cities: np.ndarray):
+    _search['graph'] = grid_graph(blocked)
+    _search['cells'] = cities[:, 0] * blocked.shape[1] + cities[:, 1]
+
+
+def _search_rows(sources: np.ndarray):
+    """
+    :return: for each source city, the costs to the cities after it
+    """
+    cells = _search['cells']
+    if not len(sources):
+        return []
+    dist = dijkstra(_search['graph'], indices=cells[sources])
+    return [dist[k, cells[i + 1:]] for k, i in enumerate(sources)]
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from uar.db import redis
+from uar.landform import generator
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis, 'redis_client', lambda *args, **kwargs: client)
+    return client
+
+
+def test_landform_round_trip(client):
+    land = generator.LandForm(60, 40, use_old=False, seed=3)
+    redis.save_landform('a', land.map, land.cities, client)
+
+    land_map, cities = redis.load_landform('a', client)
+    assert land_map.dtype == np.uint8
+    np.testing.assert_array_equal(land_map, land.map)
+    assert cities == land.cities
+
+
+def test_load_landforms_missing_key(client):
+    first = generator.LandForm(30, 30, use_old=False, seed=1)
+    second = generator.LandForm(20, 50, use_old=False, seed=2)
+    redis.save_landform('first', first.map, first.cities, client)
+    redis.save_landform('second', second.map, second.cities, client)
+
+    loaded = redis.load_landforms(['first', 'missing', 'second'], client)
+    assert loaded[1] is None
+    np.testing.assert_array_equal(loaded[0][0], first.map)
+    assert loaded[0][1] == first.cities
+    np.testing.assert_array_equal(loaded[2][0], second.map)
+    assert loaded[2][1] == second.cities
+
+
+def test_landform_stored_then_loaded(client, monkeypatch):
+    land = generator.LandForm(50, 50, seed=7)
+    assert land.key is not None
+    assert client.exists(redis.LANDFORM_PREFIX + land.key)
+
+    def fail(*args):
+        raise AssertionError('generated again')
+
+    monkeypatch.setattr(generator.LandForm, 'generate', fail)
+    again = generator.LandForm(50, 50, seed=7)
+    np.testing.assert_array_equal(again.map, land.map)
+    assert again.cities == land.cities
+
+
+def test_landform_without_redis(monkeypatch):
+    def unavailable(*args):
+        raise redis.redis.ConnectionError()
+
+    monkeypatch.setattr(redis, 'load_landform', unavailable)
+    land = generator.LandForm(20, 20, seed=7)
+    assert land.key is None
+    assert land.map.shape == (20, 20)